@@ -1,11 +1,26 @@
 import argparse
+import hashlib
+import inspect
+import json
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter
 from Distribution import listFolder
 from PIL import Image
-import matplotlib.pyplot as plt
-from os import makedirs
-from os.path import isfile, isdir, join, splitext
+from os import cpu_count, makedirs
+from os.path import abspath, dirname, exists, isfile, isdir, join, \
+    relpath, splitext
 from shutil import copytree, copy2
+import augmentations
 from augmentations import auguments
+from dataset_split import place_image
+
+AUGMENTED_RECORD = ".augmented.json"
+# Images augmented together by one job of the array engine
+ARRAY_BATCH_SIZE = 256
 
 
 def manipulateImage(img: Image.Image):
@@ -20,7 +35,19 @@ def get_filename(path: str, suffix: str):
     return f"{name}_{suffix}{ext}"
 
 
+def augmentedSource(path: str):
+    """
+    Path of the source an output of enrichDataset was made from, undoing
+    get_filename and the content hash it adds on name clashes.
+    """
+    name, ext = splitext(path)
+    match = re.fullmatch(rf"(.*)_(?:{'|'.join(auguments)})(?:_[0-9a-f]{{8}})?",
+                         name)
+    return match[1] + ext if match else None
+
+
 def singleImageAuguments(path: str):
+    import matplotlib.pyplot as plt
     with Image.open(path) as file:
         file.load()
         images = [file] + manipulateImage(file)
@@ -39,35 +66,223 @@ def singleImageAuguments(path: str):
         plt.show()
 
 
-def addFileAugument(path: str, i: int):
-    augument_index = i % len(auguments)
+def get_cache_dir(path: str):
+    return join(dirname(abspath(path)), "augmentation_cache")
+
+
+def hashSources(paths: list, cache_dir: str):
+    """
+    Content sha1 of every path. Hashes are remembered in cache_dir by
+    path, size and mtime, so unchanged files are not read again.
+    """
+    memo_path = join(cache_dir, "sources.json")
+    memo = {}
+    if isfile(memo_path):
+        with open(memo_path) as f:
+            memo = json.load(f)
+    hashes = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = memo.get(abspath(path))
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+            with open(path, "rb") as f:
+                entry = [stat.st_size, stat.st_mtime_ns,
+                         hashlib.file_digest(f, "sha1").hexdigest()]
+            memo[abspath(path)] = entry
+        hashes.append(entry[2])
+    with open(memo_path + ".tmp", "w") as f:
+        json.dump(memo, f)
+    os.replace(memo_path + ".tmp", memo_path)
+    return hashes
+
+
+def augumentJobs(dirs: list, hashes: dict):
+    """
+    List the (file path, augmentation index) variants needed to balance
+    the classes in dirs. Every image gets its first variant before any
+    gets a second one, and which images and augmentations come first
+    follows hashes of their content, so the selection never repeats a
+    variant, does not depend on listing order or file names and mostly
+    stays the same when images are added.
+    """
+    names = list(auguments.keys())
+    maxSize = max(len(dir["filenames"]) for dir in dirs)
+    jobs = []
+    for dir in dirs:
+        candidates = []
+        for filename in dir["filenames"]:
+            path = join(dir["path"], filename)
+            ranked = sorted(
+                (hashlib.sha1(f"{hashes[path]}:{name}".encode()).digest(), i)
+                for i, name in enumerate(names))
+            candidates += [(round, rank, path, i)
+                           for round, (rank, i) in enumerate(ranked)]
+        diff = maxSize - len(dir["filenames"])
+        if diff > len(candidates):
+            print(f"Only {len(candidates)} of the {diff} images missing "
+                  f"from {dir['path']} can be augmented")
+        jobs += [(path, i) for _, _, path, i in sorted(candidates)[:diff]]
+    return jobs
+
+
+def augmentVersion(engine: str):
+    """
+    Hash of the code of the engine, so that any change to it or to its
+    constants gives new cache keys.
+    """
+    modules = [augmentations]
+    if engine == "array":
+        import cv_augmentations
+        modules.append(cv_augmentations)
+    source = "".join(inspect.getsource(module) for module in modules)
+    return hashlib.sha1(source.encode()).hexdigest()[:8]
+
+
+def cachePath(cache_dir: str, sha1: str, name: str, ext: str, version: str):
+    return join(cache_dir, sha1[:2], f"{sha1}_{name}_{version}{ext.lower()}")
+
+
+def saveCached(image: Image.Image, cache_path: str):
+    makedirs(dirname(cache_path), exist_ok=True)
+    # Written under a temporary name so that an interrupted run never
+    # leaves a truncated image in the cache
+    root, ext = splitext(cache_path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    image.save(tmp_path)
+    os.replace(tmp_path, cache_path)
+
+
+def cacheAugument(job: tuple):
+    path, i, cache_path = job
     with Image.open(path) as file:
         file.load()
-        new_image = list(auguments.values())[augument_index](file)
-        suffix = list(auguments.keys())[augument_index]
-        new_image.save(get_filename(path, suffix))
+        saveCached(list(auguments.values())[i](file), cache_path)
 
 
-def enrichDataset(path: str):
-    dirs = listFolder(path)
-    sizes = list(map(len, [dir["filenames"] for dir in dirs]))
-    maxSize = max(sizes)
-    for dir in dirs:
-        filenames = dir["filenames"]
-        type_path = dir["path"]
-        if len(filenames) < maxSize:
-            diff = maxSize - len(filenames)
-            while diff > 0:
-                filename = filenames[diff % len(filenames)]
-                file_path = join(type_path, filename)
-                addFileAugument(file_path, diff)
-                diff -= 1
+def cacheAugumentBatch(job: tuple):
+    """
+    Apply augmentation i to the images of a job with the array engine,
+    one batch per image size.
+    """
+    import numpy as np
+    from cv_augmentations import cv_auguments
+    i, items = job
+    batches = {}
+    for path, cache_path in items:
+        with Image.open(path) as file:
+            image = np.asarray(file.convert("RGB"))
+        batches.setdefault(image.shape, []).append((image, cache_path))
+    augument = list(cv_auguments.values())[i]
+    for batch in batches.values():
+        new_images = augument(np.stack([image for image, _ in batch]))
+        for new_image, (_, cache_path) in zip(new_images, batch):
+            saveCached(Image.fromarray(new_image), cache_path)
+
+
+def enrichDataset(path: str, workers: int = None, cache_dir: str = None,
+                  engine: str = "array"):
+    """
+    Balance the classes of path with augmented copies of their images.
+
+    The array engine augments batches of same-sized images with
+    cv_augmentations, the pil engine one image at a time with
+    augmentations. Augmented images are computed once into cache_dir,
+    keyed by the content hash of their source, the augmentation name and
+    the version of the engine, so running again or after adding images
+    only computes missing variants. They are hardlinked into path, or
+    copied across filesystems, as <name>_<augmentation><ext>. The files
+    placed are recorded in path, so that a later run never takes them
+    for sources and removes the ones it no longer selects.
+    """
+    cache_dir = cache_dir or get_cache_dir(path)
+    record_path = join(path, AUGMENTED_RECORD)
+    placed = {}
+    if isfile(record_path):
+        with open(record_path) as f:
+            placed = json.load(f)
+    dirs = []
+    for dir in listFolder(path):
+        filenames = [f for f in dir["filenames"]
+                     if relpath(join(dir["path"], f), path) not in placed]
+        if filenames:
+            dirs.append({"path": dir["path"], "filenames": filenames})
+    if len(dirs) == 0:
+        return
+    start = perf_counter()
+    makedirs(cache_dir, exist_ok=True)
+    sources = [join(dir["path"], f) for dir in dirs for f in dir["filenames"]]
+    hashes = dict(zip(sources, hashSources(sources, cache_dir)))
+    names = list(auguments.keys())
+    version = augmentVersion(engine)
+
+    outputs = {}
+    missing = {}
+    for source, i in augumentJobs(dirs, hashes):
+        cache_path = cachePath(cache_dir, hashes[source], names[i],
+                               splitext(source)[1], version)
+        output = get_filename(source, names[i])
+        if output in hashes:
+            # Never overwrite a source that happens to have that name
+            output = get_filename(source, f"{names[i]}_{hashes[source][:8]}")
+        outputs[relpath(output, path)] = cache_path
+        if not isfile(cache_path):
+            missing[cache_path] = (source, i, cache_path)
+
+    workers = workers or cpu_count() or 1
+    jobs = list(missing.values())
+    compute, chunksize = cacheAugument, max(1, len(jobs) // (workers * 4))
+    if engine == "array":
+        groups = {}
+        for source, i, cache_path in jobs:
+            groups.setdefault(i, []).append((source, cache_path))
+        jobs = []
+        for i, items in groups.items():
+            size = min(ARRAY_BATCH_SIZE, math.ceil(len(items) / workers))
+            jobs += [(i, items[start:start + size])
+                     for start in range(0, len(items), size)]
+        compute, chunksize = cacheAugumentBatch, 1
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            compute(job)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(compute, jobs, chunksize=chunksize):
+                pass
+
+    linked = 0
+    for output, cache_path in placed.items():
+        if outputs.get(output) != cache_path and exists(join(path, output)):
+            os.remove(join(path, output))
+    for output, cache_path in outputs.items():
+        if placed.get(output) != cache_path or not exists(join(path, output)):
+            place_image(Path(cache_path), Path(path, output), "hardlink")
+            linked += 1
+    with open(record_path, "w") as f:
+        json.dump(outputs, f, indent=0)
+
+    elapsed = perf_counter() - start
+    if outputs:
+        print(f"Balanced with {len(outputs)} augmented images in "
+              f"{elapsed:.2f}s ({len(missing)} computed by the {engine} "
+              f"engine with {workers} workers, {linked} placed from "
+              f"{cache_dir})")
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Augments the data set')
     parser.add_argument('src', type=str, help='add a source file/folder')
     parser.add_argument('dst', type=str, help='add a destination folder')
+    parser.add_argument('--workers', type=int, default=cpu_count(),
+                        help='number of augmentation processes \
+                        (default: number of cores)')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='where augmented images are kept for reuse \
+                        (default: augmentation_cache next to dst)')
+    parser.add_argument('--engine', choices=['array', 'pil'],
+                        default='array',
+                        help='array: augment batches of same-sized images \
+                        with OpenCV, pil: augment one image at a time \
+                        with PIL (default: array)')
     args = parser.parse_args()
     makedirs(args.dst, exist_ok=True)
     if not isdir(args.dst):
@@ -77,6 +292,6 @@ if __name__ == '__main__':
         singleImageAuguments(new_file_path)
     elif isdir(args.src):
         copytree(args.src, args.dst, dirs_exist_ok=True)
-        enrichDataset(args.dst)
+        enrichDataset(args.dst, args.workers, args.cache_dir, args.engine)
     else:
         print("Source file reading error")
@@ -1,7 +1,6 @@
 import argparse
 from os import walk
 from os.path import isdir
-import matplotlib.pyplot as plt
 
 color_by_type = {
     "healthy": "#4CAF50",
@@ -15,7 +14,10 @@ color_by_type = {
 IMG_EXT = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp")
 
 
-def listFolder(path):
+def listFolder(path, indexed=False):
+    if indexed:
+        from dataset_index import indexed_listFolder
+        return indexed_listFolder(path)
     dirs = []
     for (dirpath, _, filenames) in walk(path):
         img_files = [f for f in filenames if f.lower().endswith(IMG_EXT)]
@@ -34,8 +36,8 @@ def getColors(dirs: list):
         return None
 
 
-def analyzeDataset(path: str, verbose=False):
-    dirs = listFolder(path)
+def analyzeDataset(path: str, verbose=False, indexed=False):
+    dirs = listFolder(path, indexed)
     labels = []
     filenames = []
     if len(dirs) == 0:
@@ -45,6 +47,7 @@ def analyzeDataset(path: str, verbose=False):
         labels.append(dir["path"].split('/')[-1])
         filenames.append(dir["filenames"])
     if verbose:
+        import matplotlib.pyplot as plt
         colors = getColors(dirs)
         sizes = list(map(len, filenames))
         fig, axs = plt.subplots(1, 2, figsize=(18, 9), constrained_layout=True)
@@ -60,8 +63,10 @@ def analyzeDataset(path: str, verbose=False):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Describes the data')
     parser.add_argument("path", type=str, help='add a folder path')
+    parser.add_argument("--index", action="store_true",
+                        help='read the folder through its dataset index')
     args = parser.parse_args()
     if isdir(args.path):
-        analyzeDataset(args.path, True)
+        analyzeDataset(args.path, True, args.index)
     else:
         print("Passed path is not a folder or doesn't exist")
@@ -1,15 +1,19 @@
 import argparse
 import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
 from PIL import Image
-import matplotlib.pyplot as plt
-from os import makedirs, scandir
-from os.path import isfile, isdir, join
+from os import cpu_count, makedirs
+from os.path import basename, getmtime, isfile, isdir, join, relpath, \
+    splitext
 
-from histogram import histogram
-from transformations import transforms
+from Distribution import listFolder
+from transformations import LeafAnalysis, get_analysis, transforms
 
 
-def manipulateImage(img: Image.Image, transform: str):
+def manipulateImage(img: Image.Image | LeafAnalysis, transform: str):
+    img = get_analysis(img)
     res = []
     if transform:
         name, func = transforms[transform]
@@ -21,10 +25,13 @@ def manipulateImage(img: Image.Image, transform: str):
 
 
 def showSingleImageTransforms(path: str, transform: str):
+    import matplotlib.pyplot as plt
     with Image.open(path) as file:
         file.load()
+        analysis = LeafAnalysis(file)
         if transform != "histogram":
-            images = [("Original", file)] + manipulateImage(file, transform)
+            images = [("Original", file)] + manipulateImage(analysis,
+                                                            transform)
 
             _, axs = plt.subplots(1, len(images), figsize=(3 * len(images), 4))
             if len(images) == 1:
@@ -37,33 +44,156 @@ def showSingleImageTransforms(path: str, transform: str):
             plt.tight_layout()
             plt.show()
         if not transform or transform == "histogram":
-            histogram(file)
+            from histogram import histogram
+            histogram(analysis)
             plt.show()
 
 
-def saveFileTransforms(filepath: str, dst: str, transform: str):
+def getOutputFilename(filepath: str, dst: str, title: str, ext: str,
+                      keep_ext: bool = False):
+    """
+    With keep_ext, the source extension is kept in the name, for sources
+    that share their stem with another image of the same folder.
+    """
+    name, src_ext = splitext(basename(filepath))
+    if keep_ext and src_ext:
+        name = f"{name}_{src_ext[1:]}"
+    return f"{dst}/{name}_{title}.{ext}"
+
+
+def sharedStems(filenames: list):
+    stems = Counter(splitext(filename)[0] for filename in filenames)
+    return {stem for stem, count in stems.items() if count > 1}
+
+
+def encodeImage(img, filename: str, quality: int):
+    if not isinstance(img, Image.Image):
+        img = Image.fromarray(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.save(filename, quality=quality)
+
+
+def saveFileTransforms(filepath: str, dst: str, transform: str,
+                       ext: str = "jpg", quality: int = 95,
+                       figures: bool = False, keep_ext: bool = False):
     with Image.open(filepath) as file:
         file.load()
+        analysis = LeafAnalysis(file)
         if transform != "histogram":
-            images = [("Original", file)] + manipulateImage(file, transform)
+            images = [("Original", file)] + manipulateImage(analysis,
+                                                            transform)
             for (title, img) in images:
-                filename = f"{dst}/{filepath.split('/')[-1][:-4]}_{title}.jpg"
-                plt.figure()
-                plt.imshow(img)
-                plt.savefig(filename)
-                plt.close()
+                filename = getOutputFilename(filepath, dst, title, ext,
+                                             keep_ext)
+                if figures:
+                    import matplotlib.pyplot as plt
+                    plt.figure()
+                    plt.imshow(img)
+                    plt.savefig(filename)
+                    plt.close()
+                else:
+                    encodeImage(img, filename, quality)
         if not transform or transform == "histogram":
-            filename = f"{dst}/{filepath.split('/')[-1][:-4]}_Histogram.jpg"
-            histogram_figure = histogram(file)
+            import matplotlib.pyplot as plt
+            from histogram import histogram
+            filename = getOutputFilename(filepath, dst, "Histogram", ext,
+                                         keep_ext)
+            histogram_figure = histogram(analysis)
             histogram_figure.savefig(filename)
             plt.close(histogram_figure)
 
 
-def createTransforms(src: str, dst: str, transform: str):
+def getOutputTitles(transform: str):
+    titles = []
+    if transform != "histogram":
+        titles.append("Original")
+        if transform:
+            titles.append(transforms[transform][0])
+        else:
+            titles.extend(name for (name, _) in transforms.values())
+    if not transform or transform == "histogram":
+        titles.append("Histogram")
+    return titles
+
+
+def isUpToDate(filepath: str, dst: str, transform: str, ext: str,
+               keep_ext: bool = False):
+    src_mtime = getmtime(filepath)
+    for title in getOutputTitles(transform):
+        filename = getOutputFilename(filepath, dst, title, ext, keep_ext)
+        if not isfile(filename) or getmtime(filename) < src_mtime:
+            return False
+    return True
+
+
+def transformJobs(src: str, dst: str, transform: str, ext: str,
+                  force: bool = False):
+    jobs = []
+    skipped = 0
+    for dir in listFolder(src):
+        out_dir = join(dst, relpath(dir["path"], src))
+        makedirs(out_dir, exist_ok=True)
+        shared = sharedStems(dir["filenames"])
+        for filename in dir["filenames"]:
+            filepath = join(dir["path"], filename)
+            keep_ext = splitext(filename)[0] in shared
+            if not force and isUpToDate(filepath, out_dir, transform, ext,
+                                        keep_ext):
+                skipped += 1
+            else:
+                jobs.append((filepath, out_dir, transform, keep_ext))
+    return jobs, skipped
+
+
+def useAggBackend():
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+
+
+def runTransformJob(job: tuple, *options):
+    filepath, dst, transform, keep_ext = job
+    try:
+        saveFileTransforms(filepath, dst, transform, *options,
+                           keep_ext=keep_ext)
+        return None
+    except Exception as e:
+        return f"Error transforming {job[0]}: {e}"
+
+
+def createTransforms(src: str, dst: str, transform: str,
+                     ext: str = "jpg", quality: int = 95,
+                     figures: bool = False, workers: int = None,
+                     force: bool = False):
+    useAggBackend()
     makedirs(dst, exist_ok=True)
-    filenames = [entry.name for entry in scandir(src) if entry.is_file()]
-    for filename in filenames:
-        saveFileTransforms(join(src, filename), dst, transform)
+    jobs, skipped = transformJobs(src, dst, transform, ext, force)
+    if skipped:
+        print(f"Skipping {skipped} images with up to date outputs")
+    if not jobs:
+        return
+    workers = workers or cpu_count() or 1
+    options = (ext, quality, figures)
+    start = perf_counter()
+
+    def report(done: int, error: str):
+        if error:
+            print(f"\n{error}")
+        rate = done / (perf_counter() - start)
+        print(f"\rTransformed {done}/{len(jobs)} images "
+              f"({rate:.1f} images/sec)", end="", flush=True)
+
+    if workers <= 1:
+        for done, job in enumerate(jobs, 1):
+            report(done, runTransformJob(job, *options))
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=useAggBackend) as executor:
+            futures = [executor.submit(runTransformJob, job, *options)
+                       for job in jobs]
+            for done, future in enumerate(as_completed(futures), 1):
+                report(done, future.result())
+    print(f"\nDone in {perf_counter() - start:.2f}s with {workers} workers")
 
 
 if __name__ == '__main__':
@@ -81,11 +211,26 @@ if __name__ == '__main__':
                         'landmarks' - pseudolandmarks,\
                         'histogram' - channels histogram"
                         )
+    parser.add_argument("-format", default="jpg",
+                        choices=["jpg", "png", "webp"],
+                        help="Output image format for directory mode")
+    parser.add_argument("-quality", type=int, default=95,
+                        help="Encoder quality for jpg and webp outputs")
+    parser.add_argument("-workers", type=int, default=cpu_count(),
+                        help="Number of processes for directory mode \
+                        (default: number of cores)")
+    parser.add_argument("-force", action="store_true",
+                        help="Regenerate outputs that are already up to date")
+    parser.add_argument("-figures", action="store_true",
+                        help="Save matplotlib figures of the transforms \
+                        instead of the images at native resolution")
     args = parser.parse_args()
     if isfile(args.src):
         showSingleImageTransforms(args.src, args.tf)
     elif isdir(args.src):
-        createTransforms(args.src, args.dst, args.tf)
+        createTransforms(args.src, args.dst, args.tf,
+                         args.format, args.quality, args.figures,
+                         args.workers, args.force)
     else:
         print("Error: wrong path")
 
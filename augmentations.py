@@ -1,8 +1,10 @@
 from PIL import Image, ImageOps
+from functools import lru_cache
 import math
 
 fillcolor = "#fff"
 scalingFactor = 0.15
+waveMeshCacheSize = 16
 
 
 def transform(x, y):
@@ -19,15 +21,20 @@ def transform_rectangle(x0, y0, x1, y1):
             )
 
 
-def getWaveMesh(img):
+@lru_cache(maxsize=waveMeshCacheSize)
+def getWaveMeshForSize(size: tuple):
     gridspace = 20
     target_grid = []
-    for x in range(0, img.size[0], gridspace):
-        for y in range(0, img.size[1], gridspace):
+    for x in range(0, size[0], gridspace):
+        for y in range(0, size[1], gridspace):
             target_grid.append((x, y, x + gridspace, y + gridspace))
 
     source_grid = [transform_rectangle(*rect) for rect in target_grid]
-    return [t for t in zip(target_grid, source_grid)]
+    return tuple(zip(target_grid, source_grid))
+
+
+def getWaveMesh(img):
+    return getWaveMeshForSize(img.size)
 
 
 def crop(img: Image.Image):
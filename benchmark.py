@@ -0,0 +1,340 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import warnings
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from Distribution import listFolder
+
+SECTIONS = ("augmentations", "transforms", "histogram", "pipeline",
+            "inference")
+# class name: (share of the dataset, disease spot color or None)
+SYNTHETIC_CLASSES = {
+    "Apple_healthy": (0.4, None),
+    "Apple_rust": (0.3, (183, 65, 14)),
+    "Apple_scab": (0.2, (75, 54, 33)),
+    "Grape_Esca": (0.1, (139, 69, 19)),
+}
+
+
+def make_leaf(rng: np.random.Generator, size: int = 256, spots=None):
+    """
+    A leaf-like test image: a rotated green ellipse with a vein on a
+    white background, optional disease spots and sensor noise.
+    """
+    img = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(img)
+    cx, cy = rng.uniform(0.4, 0.6, 2) * size
+    rx, ry = rng.uniform(0.2, 0.3) * size, rng.uniform(0.32, 0.42) * size
+    green = tuple(int(c) for c in rng.integers((30, 110, 20), (80, 170, 60)))
+    draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=green)
+    draw.line((cx, cy - ry, cx, cy + ry), fill=(150, 190, 110), width=2)
+    if spots is not None:
+        for _ in range(rng.integers(3, 12)):
+            x, y = cx + rng.uniform(-0.6, 0.6) * rx, \
+                cy + rng.uniform(-0.6, 0.6) * ry
+            r = rng.uniform(0.01, 0.04) * size
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=spots)
+    img = img.rotate(rng.uniform(-40, 40), fillcolor="white")
+    noise = rng.normal(0, 6, (size, size, 3))
+    return Image.fromarray(np.clip(np.asarray(img) + noise, 0, 255)
+                           .astype(np.uint8))
+
+
+def make_dataset(root: str, n_images: int, size: int = 256, seed: int = 0):
+    """
+    Write n_images synthetic leaves as JPEG class folders under root,
+    with the class imbalance of SYNTHETIC_CLASSES.
+    """
+    rng = np.random.default_rng(seed)
+    for class_name, (share, spots) in SYNTHETIC_CLASSES.items():
+        os.makedirs(os.path.join(root, class_name), exist_ok=True)
+        for i in range(max(1, round(n_images * share))):
+            make_leaf(rng, size, spots).save(
+                os.path.join(root, class_name, f"image ({i}).JPG"),
+                quality=90)
+    return root
+
+
+def sample_images(n: int, size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    spots = [spot for _, spot in SYNTHETIC_CLASSES.values()]
+    return [make_leaf(rng, size, spots[i % len(spots)]) for i in range(n)]
+
+
+def time_per_item(func, items: list, repeats: int):
+    """Median over repeats of the time of func on every item, per item."""
+    for item in items[:1]:
+        func(item)
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        for item in items:
+            func(item)
+        times.append(perf_counter() - start)
+    return median(times) / len(items)
+
+
+def count_images(path: str):
+    return sum(len(dir["filenames"]) for dir in listFolder(str(path)))
+
+
+def bench_augmentations(images: list, repeats: int):
+    from augmentations import auguments
+    from cv_augmentations import cv_auguments
+    results = {f"augmentation.{name}.s_per_image":
+               time_per_item(func, images, repeats)
+               for name, func in auguments.items()}
+    # The array engine augments all the images as one batch
+    batch = [np.stack([np.asarray(img) for img in images])]
+    results.update({f"augmentation_array.{name}.s_per_image":
+                    time_per_item(func, batch, repeats) / len(images)
+                    for name, func in cv_auguments.items()})
+    return results
+
+
+def bench_transforms(images: list, repeats: int):
+    from Transformation import manipulateImage
+    from transformations import transforms
+    results = {f"transform.{name}.s_per_image":
+               time_per_item(func, images, repeats)
+               for name, func in transforms.values()}
+    results["transform.all_shared_analysis.s_per_image"] = time_per_item(
+        lambda img: manipulateImage(img, None), images, repeats)
+    return results
+
+
+def bench_histogram(images: list, repeats: int):
+    import matplotlib.pyplot as plt
+    from histogram import histogram, histogram_matrix
+
+    def plot(img):
+        plt.close(histogram(img))
+    return {
+        "histogram.matrix.s_per_image":
+            time_per_item(histogram_matrix, images, repeats),
+        "histogram.figure.s_per_image":
+            time_per_item(plot, images, repeats),
+    }
+
+
+def bench_pipeline(workdir: str, n_images: int, image_size: int,
+                   workers: int, seed: int):
+    """
+    Generate a dataset of n_images and run every stage on it once:
+    split, disk augmentation of the train split, transformation and
+    histogram statistics of the test split. Times are per 1k images
+    processed by the stage.
+    """
+    from Augmentation import enrichDataset
+    from Transformation import createTransforms
+    from dataset_split import split_dataset
+    from histogram import histogram_statistics
+
+    root = os.path.join(workdir, f"pipeline_{n_images}")
+    prefix = f"pipeline.{n_images}"
+    results = {}
+
+    def stage(name, count, func, *args):
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*args)
+        elapsed = perf_counter() - start
+        results[f"{prefix}.{name}.s_per_1k"] = elapsed * 1000 / max(count, 1)
+        return result
+
+    start = perf_counter()
+    source = make_dataset(os.path.join(root, "images"), n_images,
+                          image_size, seed)
+    results[f"{prefix}.generate.s_per_1k"] = \
+        (perf_counter() - start) * 1000 / n_images
+    n_images = count_images(source)
+
+    train_path, test_path = stage("split", n_images, split_dataset,
+                                  source, 0.8)
+
+    train_before = count_images(train_path)
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        enrichDataset(str(train_path), workers)
+    augmented = count_images(train_path) - train_before
+    results[f"{prefix}.augment.s_per_1k"] = \
+        (perf_counter() - start) * 1000 / max(augmented, 1)
+    # Everything is cached and placed by now, what is left is the cost
+    # of finding that out
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        enrichDataset(str(train_path), workers)
+    results[f"{prefix}.augment_rerun.s_per_1k"] = \
+        (perf_counter() - start) * 1000 / max(augmented, 1)
+
+    n_test = count_images(test_path)
+    stage("transform", n_test, createTransforms, str(test_path),
+          os.path.join(root, "transformed"), None, "jpg", 95, False,
+          workers, True)
+    stage("histogram_statistics", n_test, histogram_statistics,
+          str(test_path), os.path.join(root, "histograms.npz"))
+    shutil.rmtree(root)
+    return results
+
+
+def bench_inference(workdir: str, path_model: str, images: list,
+                    repeats: int, batch_sizes=(1, 8, 32)):
+    """
+    Model load time, latency per batch size and the end to end latency
+    of a single JPEG (decode, resize, predict). Without path_model an
+    untrained model of the training architecture is used, which has the
+    same cost as a trained one.
+    """
+    from predict import IMAGE_SIZE, load_image_array, load_model, \
+        predict_batch
+    if path_model is None:
+        from train import build_model
+        path_model = os.path.join(workdir, "benchmark_model.keras")
+        build_model().save(path_model)
+
+    start = perf_counter()
+    with warnings.catch_warnings():
+        # The untrained model is saved before its optimizer is built
+        warnings.simplefilter("ignore")
+        model = load_model(path_model)
+    results = {"inference.load.s": perf_counter() - start}
+    inputs = np.stack([np.asarray(img.resize(IMAGE_SIZE), np.float32)
+                       for img in images])
+    for batch_size in batch_sizes:
+        batch = np.resize(inputs, (batch_size, *inputs.shape[1:]))
+        results[f"inference.batch_{batch_size}.s_per_batch"] = \
+            time_per_item(lambda b: predict_batch(model, b), [batch],
+                          repeats * 4)
+
+    jpeg = os.path.join(workdir, "single.jpg")
+    images[0].save(jpeg, quality=90)
+    results["inference.single_image_end_to_end.s"] = time_per_item(
+        lambda path: predict_batch(
+            model, load_image_array(path)[np.newaxis]), [jpeg], repeats * 4)
+    return results
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float):
+    """Metrics slower than baseline by more than tolerance, worst first."""
+    regressions = []
+    for name, seconds in results.items():
+        previous = baseline.get(name)
+        if previous and seconds > previous * (1 + tolerance):
+            regressions.append({"metric": name, "baseline": previous,
+                                "current": seconds,
+                                "ratio": seconds / previous})
+    return sorted(regressions, key=lambda r: -r["ratio"])
+
+
+def run_benchmarks(sections=SECTIONS, sizes=(100, 400), image_size=256,
+                   samples=16, repeats=3, workers=None, path_model=None,
+                   seed=0):
+    """
+    Run the selected benchmark sections on synthetic images generated
+    from seed and return {metric name: seconds}. Metric names end with
+    their unit, lower is always better.
+    """
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+    images = sample_images(samples, image_size, seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for section in sections:
+            print(f"Running {section} benchmarks...", flush=True)
+            if section == "augmentations":
+                results.update(bench_augmentations(images, repeats))
+            elif section == "transforms":
+                results.update(bench_transforms(images, repeats))
+            elif section == "histogram":
+                results.update(bench_histogram(images, repeats))
+            elif section == "pipeline":
+                for n_images in sizes:
+                    results.update(bench_pipeline(workdir, n_images,
+                                                  image_size, workers, seed))
+            elif section == "inference":
+                results.update(bench_inference(workdir, path_model, images,
+                                               repeats))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark augmentations, transformations, histograms, \
+            dataset pipeline stages and inference on synthetic leaves"
+    )
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS,
+                        default=list(SECTIONS),
+                        help="Benchmarks to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 400],
+                        help="Dataset sizes of the pipeline benchmark \
+                            (default: 100 400)")
+    parser.add_argument("--image-size", type=int, default=256,
+                        help="Side of the synthetic images (default: 256)")
+    parser.add_argument("--samples", type=int, default=16,
+                        help="Images timed per augmentation and transform \
+                            (default: 16)")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Repeats of each timing, the median is kept \
+                            (default: 3)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes of the pipeline stages \
+                            (default: number of cores)")
+    parser.add_argument("--model", default=None,
+                        help="Model to benchmark inference with (default: \
+                            an untrained model of the training architecture)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the synthetic images (default: 0)")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="Results file (default: benchmark.json)")
+    parser.add_argument("--baseline", default=None,
+                        help="Previous results file to flag regressions \
+                            against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed slowdown before a metric is flagged \
+                            (default: 0.15)")
+    args = parser.parse_args()
+
+    if args.model and not os.path.isfile(args.model):
+        parser.error(f"no model found at {args.model}")
+    results = run_benchmarks(args.sections, args.sizes, args.image_size,
+                             args.samples, args.repeats, args.workers,
+                             args.model, args.seed)
+    for name, seconds in results.items():
+        print(f"{name:<60}{seconds * 1000:>12.3f} ms")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_results(results, baseline, args.tolerance)
+        print(f"\n{len(regressions)} regressions over {args.tolerance:.0%} "
+              f"against {args.baseline}")
+        for r in regressions:
+            print(f"{r['metric']:<60}{r['baseline'] * 1000:>12.3f} -> "
+                  f"{r['current'] * 1000:.3f} ms (x{r['ratio']:.2f})")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "arguments": vars(args),
+            "results": results,
+            "regressions": regressions,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+    if regressions:
+        sys.exit(1)
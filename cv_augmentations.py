@@ -0,0 +1,167 @@
+import math
+from functools import lru_cache
+import cv2
+import numpy as np
+
+from augmentations import scalingFactor, transform_rectangle
+
+fillvalue = (255, 255, 255)
+
+
+def rotateMatrix(width: int, height: int, angle: float = -20):
+    """
+    Output size and inverse affine matrix of Image.rotate(angle,
+    expand=True), as PIL computes them.
+    """
+    angle = -math.radians(angle % 360.0)
+    a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    d, e = -b, a
+    cx, cy = width / 2.0, height / 2.0
+    c = a * -cx + b * -cy + cx
+    f = d * -cx + e * -cy + cy
+    xs, ys = [], []
+    for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+        xs.append(a * x + b * y + c)
+        ys.append(d * x + e * y + f)
+    new_width = math.ceil(max(xs)) - math.floor(min(xs))
+    new_height = math.ceil(max(ys)) - math.floor(min(ys))
+    x, y = -(new_width - width) / 2.0, -(new_height - height) / 2.0
+    c, f = a * x + b * y + c, d * x + e * y + f
+    return (new_width, new_height), np.array([[a, b, c], [d, e, f]])
+
+
+def meshMap(width: int, height: int, mesh: list):
+    """
+    Source pixel of every output pixel of a MESH transform with nearest
+    resampling, computed like PIL does for each (box, quad) pair.
+    """
+    sources = np.full((height, width, 2), -1, dtype=np.int16)
+    for (x0, y0, x1, y1), quad in mesh:
+        w, h = x1 - x0, y1 - y0
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, width), min(y1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        nw, sw, se, ne = quad[0:2], quad[2:4], quad[4:6], quad[6:8]
+        y, x = np.mgrid[0:y1 - y0, 0:x1 - x0] + 0.5
+        for axis in range(2):
+            a0 = nw[axis]
+            a1 = (ne[axis] - a0) / w
+            a2 = (sw[axis] - a0) / h
+            a3 = (se[axis] - sw[axis] - ne[axis] + a0) / (w * h)
+            sources[y0:y1, x0:x1, axis] = np.floor(
+                a0 + a1 * x + a2 * y + a3 * x * y).clip(-1, 2**15 - 1)
+    return sources
+
+
+@lru_cache(maxsize=16)
+def getSampleMaps(height: int, width: int):
+    """
+    Transform matrices and source pixel maps of the geometric
+    augmentations, built once per image size.
+    """
+    size, matrix = rotateMatrix(width, height)
+    # PIL samples at pixel centers and floors, OpenCV rounds
+    matrix[:, 2] += matrix[:, :2].sum(axis=1) * 0.5 - 0.5
+    maps = {"Rotate": (size, matrix)}
+
+    maps["Deform"] = meshMap(width, height, [(
+        (0, 0, width, height),
+        (0, -50, -50, height, width + 20, height + 90, width, 0))])
+
+    gridspace = 20
+    maps["Wave"] = meshMap(width, height, [
+        ((x, y, x + gridspace, y + gridspace),
+         transform_rectangle(x, y, x + gridspace, y + gridspace))
+        for x in range(0, width, gridspace)
+        for y in range(0, height, gridspace)])
+    return maps
+
+
+def remap(images, sources):
+    out = np.empty_like(images)
+    for image, new_image in zip(images, out):
+        cv2.remap(image, sources, None, cv2.INTER_NEAREST, dst=new_image,
+                  borderMode=cv2.BORDER_CONSTANT, borderValue=fillvalue)
+    return out
+
+
+def resize(images, size, interpolation=cv2.INTER_CUBIC):
+    out = np.empty((len(images), size[1], size[0], 3), dtype=np.uint8)
+    for image, new_image in zip(images, out):
+        cv2.resize(image, size, dst=new_image, interpolation=interpolation)
+    return out
+
+
+def flip(images):
+    out = np.empty_like(images)
+    for image, new_image in zip(images, out):
+        cv2.flip(image, 1, dst=new_image)
+    return out
+
+
+def rotate(images):
+    """Like PIL, the output grows to fit the rotated image."""
+    size, matrix = getSampleMaps(*images.shape[1:3])["Rotate"]
+    out = np.empty((len(images), size[1], size[0], 3), dtype=np.uint8)
+    for image, new_image in zip(images, out):
+        cv2.warpAffine(image, matrix, size, dst=new_image,
+                       flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+                       borderMode=cv2.BORDER_CONSTANT, borderValue=fillvalue)
+    return out
+
+
+def blur(images):
+    height, width = images.shape[1:3]
+    small = resize(images, (round(width * 0.3), round(height * 0.3)),
+                   cv2.INTER_AREA)
+    return resize(small, (width, height))
+
+
+def contrast(images, cutoff=5):
+    """
+    Autocontrast of every channel, cutting cutoff percent of the pixels
+    at both ends of its histogram, applied with one lookup table per
+    image.
+    """
+    histograms = np.array([
+        [cv2.calcHist([image], [channel], None, [256], [0, 256])[:, 0]
+         for channel in range(3)] for image in images])
+    cut = images.shape[1] * images.shape[2] * cutoff // 100
+    low = np.argmax(histograms.cumsum(axis=2) > cut, axis=2)
+    high = 255 - np.argmax(histograms[..., ::-1].cumsum(axis=2) > cut, axis=2)
+    scale = 255.0 / np.maximum(high - low, 1)[..., None]
+    values = np.arange(256)
+    luts = np.clip((values * scale + -low[..., None] * scale).astype(int),
+                   0, 255)
+    luts = np.where((high > low)[..., None], luts, values).astype(np.uint8)
+    out = np.empty_like(images)
+    for image, lut, new_image in zip(images, luts, out):
+        cv2.LUT(image, lut.T[:, None, :], dst=new_image)
+    return out
+
+
+def crop(images):
+    height, width = images.shape[1:3]
+    border = round(scalingFactor * width)
+    return resize(images[:, border:height - border, border:width - border],
+                  (width, height))
+
+
+def deform(images):
+    return remap(images, getSampleMaps(*images.shape[1:3])["Deform"])
+
+
+def wave(images):
+    return remap(images, getSampleMaps(*images.shape[1:3])["Wave"])
+
+
+cv_auguments = {
+    "Flip": flip,
+    "Rotate": rotate,
+    "Blur": blur,
+    "Contrast": contrast,
+    "Crop": crop,
+    "Deform": deform,
+    "Wave": wave
+    }
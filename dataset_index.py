@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+from os.path import basename, isdir, join, normpath
+
+from PIL import Image
+
+from Distribution import IMG_EXT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    rel TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    rel_dir TEXT,
+    name TEXT,
+    class TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    sha1 TEXT,
+    PRIMARY KEY (rel_dir, name)
+);
+"""
+
+
+def get_index_path(root: str):
+    return normpath(os.path.abspath(root)) + ".index.sqlite"
+
+
+def describe_image(path: str):
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Exception:
+        width, height = None, None
+    with open(path, "rb") as f:
+        sha1 = hashlib.file_digest(f, "sha1").hexdigest()
+    return width, height, sha1
+
+
+class DatasetIndex:
+    """
+    On-disk index of the images under root, stored in SQLite next to it.
+
+    refresh() only lists directories whose mtime changed since the last
+    refresh, and only reads files that are new or whose size or mtime
+    changed. Files rewritten in place without touching their directory
+    are picked up by refresh(full=True).
+    """
+
+    def __init__(self, root: str, db_path: str = None):
+        self.root = root
+        self.db = sqlite3.connect(db_path or get_index_path(root))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def full_path(self, rel: str):
+        return join(self.root, rel) if rel else self.root
+
+    def scan_dir(self, rel: str, full: bool):
+        stored = {name: (size, mtime) for name, size, mtime in self.db.execute(
+            "SELECT name, size, mtime_ns FROM files WHERE rel_dir = ?",
+            (rel,))}
+        subdirs = []
+        present = set()
+        updated = 0
+        with os.scandir(self.full_path(rel)) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(join(rel, entry.name) if rel
+                                   else entry.name)
+                    continue
+                if not entry.is_file() or \
+                        not entry.name.lower().endswith(IMG_EXT):
+                    continue
+                present.add(entry.name)
+                stat = entry.stat()
+                if not full and stored.get(entry.name) == \
+                        (stat.st_size, stat.st_mtime_ns):
+                    continue
+                width, height, sha1 = describe_image(entry.path)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?)",
+                    (rel, entry.name, basename(normpath(self.full_path(rel))),
+                     stat.st_size, stat.st_mtime_ns, width, height, sha1))
+                updated += 1
+        removed = set(stored) - present
+        self.db.executemany(
+            "DELETE FROM files WHERE rel_dir = ? AND name = ?",
+            [(rel, name) for name in removed])
+        return subdirs, updated, len(removed)
+
+    def refresh(self, full: bool = False):
+        stored = dict(self.db.execute("SELECT rel, mtime_ns FROM dirs"))
+        seen = set()
+        stack = [""]
+        scanned = updated = removed = 0
+        while stack:
+            rel = stack.pop()
+            try:
+                mtime = os.stat(self.full_path(rel)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            seen.add(rel)
+            if not full and stored.get(rel) == mtime:
+                subdirs = [child for (child,) in self.db.execute(
+                    "SELECT rel FROM dirs WHERE parent = ? AND rel != ''",
+                    (rel,))]
+            else:
+                subdirs, file_updates, file_removals = \
+                    self.scan_dir(rel, full)
+                scanned += 1
+                updated += file_updates
+                removed += file_removals
+                self.db.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?,?,?)",
+                    (rel, os.path.dirname(rel), mtime))
+            stack.extend(subdirs)
+        for rel in set(stored) - seen:
+            self.db.execute("DELETE FROM dirs WHERE rel = ?", (rel,))
+            removed += self.db.execute(
+                "DELETE FROM files WHERE rel_dir = ?", (rel,)).rowcount
+        self.db.commit()
+        return {"scanned_dirs": scanned, "updated_files": updated,
+                "removed_files": removed}
+
+    def list_folder(self):
+        """Same result as Distribution.listFolder, read from the index."""
+        dirs = {}
+        for rel, name in self.db.execute(
+                "SELECT rel_dir, name FROM files ORDER BY rel_dir, name"):
+            dirs.setdefault(rel, []).append(name)
+        return [{"path": self.full_path(rel), "filenames": filenames}
+                for rel, filenames in dirs.items()]
+
+    def files(self, class_name: str = None):
+        """Yield a dict per indexed image, optionally of a single class."""
+        query = "SELECT * FROM files"
+        params = ()
+        if class_name is not None:
+            query += " WHERE class = ?"
+            params = (class_name,)
+        cursor = self.db.execute(query + " ORDER BY rel_dir, name", params)
+        columns = [column[0] for column in cursor.description]
+        for row in cursor:
+            record = dict(zip(columns, row))
+            record["path"] = join(self.full_path(record["rel_dir"]),
+                                  record["name"])
+            yield record
+
+
+def indexed_listFolder(path: str, full: bool = False):
+    with DatasetIndex(path) as index:
+        index.refresh(full)
+        return index.list_folder()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Builds or refreshes the image index of a dataset')
+    parser.add_argument("path", type=str, help='add a folder path')
+    parser.add_argument("--db", type=str, default=None,
+                        help='index file (default: <path>.index.sqlite)')
+    parser.add_argument("--full", action="store_true",
+                        help='rescan every directory and file')
+    args = parser.parse_args()
+    if isdir(args.path):
+        with DatasetIndex(args.path, args.db) as index:
+            print(index.refresh(args.full))
+            for dir in index.list_folder():
+                print(f"{dir['path']}: {len(dir['filenames'])} images")
+    else:
+        print("Passed path is not a folder or doesn't exist")
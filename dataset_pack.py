@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dataset_split import iter_images, read_manifest
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+
+PACK_META = "pack.json"
+
+
+def is_pack(path) -> bool:
+    return os.path.isfile(os.path.join(path, PACK_META))
+
+
+def list_source(src: str):
+    """
+    Return (paths, labels, class names) of a class folder tree or a
+    dataset_split manifest, with classes in sorted order like Keras.
+    """
+    if src.endswith(".csv"):
+        rows = read_manifest(src)
+    else:
+        images = iter_images(Path(src).resolve())
+        rows = sorted(((str(path), class_name) for class_name, path in images),
+                      key=lambda row: (row[1], row[0]))
+    class_names = sorted({label for _, label in rows})
+    index = {name: i for i, name in enumerate(class_names)}
+    return ([path for path, _ in rows], [index[label] for _, label in rows],
+            class_names)
+
+
+def source_fingerprint(paths: list, labels: list, class_names: list,
+                       image_size):
+    """
+    Digest of the files, labels, sizes and modification times of the
+    images of a pack and of its image size.
+    """
+    digest = hashlib.sha1(json.dumps([class_names, list(image_size)])
+                          .encode())
+    for path, label in zip(paths, labels):
+        stat = os.stat(path)
+        digest.update(f"{path}\0{label}\0{stat.st_size}\0"
+                      f"{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def pack_dataset(src: str, dst: str, image_size=(64, 64),
+                 shard_size: int = 10000):
+    """
+    Decode and resize every image of src once, with the same ops as the
+    training loaders, into uint8 .npy shards of at most shard_size images
+    that can be memory-mapped, plus labels, file paths and class names.
+    A pack already in dst is reused when its images have not changed.
+    """
+    import tensorflow as tf
+    from manifest_dataset import load_image
+    paths, labels, class_names = list_source(src)
+    if not paths:
+        raise ValueError(f"No images found in {src}")
+    fingerprint = source_fingerprint(paths, labels, class_names, image_size)
+    meta_path = os.path.join(dst, PACK_META)
+    if is_pack(dst):
+        with open(meta_path) as f:
+            if json.load(f).get("fingerprint") == fingerprint:
+                print(f"Reusing the pack of {len(paths)} images in {dst}")
+                return dst
+        # A repack interrupted halfway must never be read as valid
+        os.remove(meta_path)
+    os.makedirs(dst, exist_ok=True)
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels)).map(
+        lambda path, label: load_image(path, label, image_size),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=True,
+    ).batch(256).prefetch(tf.data.AUTOTUNE)
+
+    start = time.perf_counter()
+    shards = []
+    written = 0
+    shard = None
+    for images, batch_labels in dataset:
+        images = np.clip(np.round(images.numpy()), 0, 255).astype(np.uint8)
+        batch_labels = batch_labels.numpy()
+        offset = 0
+        while offset < len(images):
+            if shard is None or shard["filled"] == shard["count"]:
+                count = min(shard_size, len(paths) - written)
+                name = f"shard_{len(shards):05d}"
+                shard = {
+                    "images": f"{name}_images.npy",
+                    "labels": f"{name}_labels.npy",
+                    "count": count,
+                    "filled": 0,
+                }
+                shard["image_array"] = np.lib.format.open_memmap(
+                    os.path.join(dst, shard["images"]), mode="w+",
+                    dtype=np.uint8, shape=(count, *image_size, 3))
+                shard["label_array"] = np.lib.format.open_memmap(
+                    os.path.join(dst, shard["labels"]), mode="w+",
+                    dtype=np.int32, shape=(count,))
+                shards.append(shard)
+            take = min(len(images) - offset, shard["count"] - shard["filled"])
+            fill = slice(shard["filled"], shard["filled"] + take)
+            shard["image_array"][fill] = images[offset:offset + take]
+            shard["label_array"][fill] = batch_labels[offset:offset + take]
+            shard["filled"] += take
+            offset += take
+            written += take
+
+    for shard in shards:
+        shard["image_array"].flush()
+        shard["label_array"].flush()
+        del shard["image_array"], shard["label_array"], shard["filled"]
+    with open(os.path.join(dst, "paths.txt"), "w") as f:
+        f.write("\n".join(paths) + "\n")
+    # Written last, so that a pack only exists once it is complete
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump({"class_names": class_names,
+                   "image_size": list(image_size),
+                   "count": written,
+                   "fingerprint": fingerprint,
+                   "shards": shards}, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+    elapsed = time.perf_counter() - start
+    print(f"Packed {written} images of {len(class_names)} classes into "
+          f"{len(shards)} shards in {elapsed:.2f}s "
+          f"({written / elapsed:.1f} images/sec)")
+    return dst
+
+
+class PackReader:
+    """Memory-mapped view of a packed dataset, gathered by global index."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, PACK_META)) as f:
+            self.meta = json.load(f)
+        self.images = [np.load(os.path.join(path, shard["images"]),
+                               mmap_mode="r")
+                       for shard in self.meta["shards"]]
+        self.labels = np.concatenate([
+            np.load(os.path.join(path, shard["labels"]))
+            for shard in self.meta["shards"]])
+        self.offsets = np.cumsum([0] + [len(a) for a in self.images])
+        with open(os.path.join(path, "paths.txt")) as f:
+            self.paths = f.read().splitlines()
+
+    def gather(self, indices: np.ndarray):
+        images = np.empty((len(indices), *self.images[0].shape[1:]),
+                          np.uint8)
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        for shard_id in np.unique(shard_ids):
+            where = shard_ids == shard_id
+            local = indices[where] - self.offsets[shard_id]
+            images[where] = self.images[shard_id][local]
+        return images, self.labels[indices]
+
+
+def packed_dataset(path: str, batch_size: int = 32, shuffle: bool = False,
+                   seed: int = None, validation_split: float = None):
+    """
+    Batched (float32 image, int label) datasets over a pack, matching
+    image_dataset_from_directory. Batches are gathered from the memory
+    maps, so only the images of the current batch are ever copied.
+    With validation_split, returns a (training, validation) pair.
+    """
+    import tensorflow as tf
+    reader = PackReader(path)
+    indices = np.arange(reader.meta["count"])
+    if shuffle or validation_split:
+        indices = np.random.RandomState(seed).permutation(len(indices))
+    image_shape = (*reader.meta["image_size"], 3)
+
+    def make(split_indices, shuffle_each_epoch):
+        dataset = tf.data.Dataset.from_tensor_slices(split_indices)
+        if shuffle_each_epoch:
+            dataset = dataset.shuffle(len(split_indices), seed=seed)
+        dataset = dataset.batch(batch_size).map(
+            lambda batch: tf.numpy_function(reader.gather, [batch],
+                                            (tf.uint8, tf.int32)),
+            num_parallel_calls=tf.data.AUTOTUNE)
+
+        def to_float(images, labels):
+            images.set_shape((None, *image_shape))
+            labels.set_shape((None,))
+            return tf.cast(images, tf.float32), labels
+
+        dataset = dataset.map(to_float).prefetch(tf.data.AUTOTUNE)
+        dataset.class_names = reader.meta["class_names"]
+        dataset.file_paths = [reader.paths[i] for i in split_indices] \
+            if not shuffle_each_epoch else None
+        return dataset
+
+    if not validation_split:
+        return make(indices, shuffle)
+    split = len(indices) - int(validation_split * len(indices))
+    return make(indices[:split], shuffle), make(indices[split:], False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack a split into memory-mapped, pre-resized arrays"
+    )
+    parser.add_argument("src", help="Class folder tree or split manifest")
+    parser.add_argument("dst", help="Output pack directory")
+    parser.add_argument("--image-size", type=int, default=64,
+                        help="Side of the packed images (default: 64)")
+    parser.add_argument("--shard-size", type=int, default=10000,
+                        help="Images per shard file (default: 10000)")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.src) or os.path.isfile(args.src):
+        pack_dataset(args.src, args.dst, (args.image_size, args.image_size),
+                     args.shard_size)
+    else:
+        print(f"Error: {args.src} does not exist")
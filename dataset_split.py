@@ -1,3 +1,7 @@
+import os
+import csv
+import hashlib
+import json
 import shutil
 import random
 import argparse
@@ -5,6 +9,11 @@ from pathlib import Path
 from collections import defaultdict
 import sys
 
+from Distribution import IMG_EXT
+
+SPLIT_MODES = ("copy", "hardlink", "symlink", "manifest")
+SPLIT_STRATEGIES = ("shuffle", "hash")
+
 
 def reset_dirs(paths: list[Path]):
     for path in paths:
@@ -17,7 +26,21 @@ def reset_dirs(paths: list[Path]):
         path.mkdir(parents=True)
 
 
-def collect_images_by_class(src_path):
+def indexed_images(src_path):
+    """
+    Yield (class name, image path) pairs of the class folders from the
+    dataset index of src_path, refreshing it first.
+    """
+    from dataset_index import DatasetIndex
+
+    with DatasetIndex(str(src_path)) as index:
+        index.refresh()
+        for record in index.files():
+            if record["rel_dir"] and "/" not in record["rel_dir"]:
+                yield record["rel_dir"], Path(record["path"])
+
+
+def collect_images_by_class(src_path, use_index=False):
     if not src_path.exists():
         raise FileNotFoundError(f"Source directory does not exist: {src_path}")
 
@@ -26,47 +49,66 @@ def collect_images_by_class(src_path):
 
     images_by_class = defaultdict(list)
 
-    for item in src_path.iterdir():
-        if item.is_dir():
-            class_name = item.name
-            jpg_files = []
-
-            for file_path in item.iterdir():
-                if file_path.is_file() and file_path.suffix.lower() == '.jpg':
-                    jpg_files.append(file_path)
-
-            if jpg_files:
-                images_by_class[class_name] = jpg_files
-                print(f"Class '{class_name}': {len(jpg_files)} .jpg images")
-            else:
-                print(f"Warning: No .jpg images found in class '{class_name}'")
+    if use_index:
+        for class_name, image_path in indexed_images(src_path):
+            images_by_class[class_name].append(image_path)
+        for class_name, images in images_by_class.items():
+            print(f"Class '{class_name}': {len(images)} images")
+    else:
+        for item in src_path.iterdir():
+            if item.is_dir():
+                class_name = item.name
+                image_files = []
+
+                for file_path in item.iterdir():
+                    if file_path.is_file() and \
+                            file_path.suffix.lower() in IMG_EXT:
+                        image_files.append(file_path)
+
+                if image_files:
+                    images_by_class[class_name] = image_files
+                    print(f"Class '{class_name}': {len(image_files)} images")
+                else:
+                    print(f"Warning: No images found in class '{class_name}'")
 
     if not images_by_class:
         raise ValueError("No classes with images found in source directory")
 
     total_images = sum(len(images) for images in images_by_class.values())
-    print(f"Total .jpg images found: {total_images}")
+    print(f"Total images found: {total_images}")
 
     return images_by_class
 
 
-def create_output_directories(source_path, images_by_class):
+def create_output_directories(source_path, images_by_class, mode="copy",
+                              reset=True):
     """
     Create train and test directories with class subfolders.
 
     Args:
         source_path (Path): Path to the source directory
         images_by_class (dict): Dictionary of images by class
+        mode (str): One of SPLIT_MODES; "manifest" creates no directories
+            and returns the paths of the train and test file lists
+        reset (bool): Empty previous outputs first (default: True)
 
     Returns:
         tuple: Paths to train and test directories
     """
     parent_dir = source_path.parent
     submission_path = parent_dir / "submission"
+    if mode == "manifest":
+        submission_path.mkdir(exist_ok=True)
+        return submission_path / "train.csv", submission_path / "test.csv"
+
     train_path = submission_path / "augmented_directory"
     test_path = submission_path / "test"
 
-    reset_dirs([submission_path, train_path, test_path])
+    if reset:
+        reset_dirs([submission_path, train_path, test_path])
+    else:
+        train_path.mkdir(parents=True, exist_ok=True)
+        test_path.mkdir(parents=True, exist_ok=True)
 
     for class_name in images_by_class.keys():
         (train_path / class_name).mkdir(exist_ok=True)
@@ -79,17 +121,56 @@ def create_output_directories(source_path, images_by_class):
     return train_path, test_path
 
 
+def place_image(image_path, dst_path, mode="copy"):
+    """
+    Make image_path available at dst_path by copying or linking it.
+    Links fall back to a copy when the filesystem does not support them.
+    """
+    if mode == "hardlink":
+        try:
+            os.link(image_path, dst_path)
+            return
+        except OSError:
+            pass
+    elif mode == "symlink":
+        try:
+            dst_path.symlink_to(image_path.resolve())
+            return
+        except OSError:
+            pass
+    shutil.copy2(image_path, dst_path)
+
+
+def write_manifest(path, rows):
+    """Write (class name, image path) rows as a path,label CSV file."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "label"])
+        for class_name, image_path in rows:
+            writer.writerow([image_path.resolve(), class_name])
+
+
+def read_manifest(path):
+    """Return the (image path, class name) rows of a manifest file."""
+    with open(path, newline="") as f:
+        return [(row["path"], row["label"]) for row in csv.DictReader(f)]
+
+
 def split_and_distribute_images(images_by_class, train_path,
-                                test_path, train_ratio=0.9):
+                                test_path, train_ratio=0.9, mode="copy"):
     """
     Args:
         images_by_class (dict): Dictionary of images by class
         train_path (Path): Path to training directory
         test_path (Path): Path to test directory
         train_ratio (float): Ratio of images for training (default: 0.9)
+        mode (str): How images reach the split, one of SPLIT_MODES
+            (default: "copy"). In "manifest" mode train_path and test_path
+            are the CSV file lists to write.
     """
     total_train = 0
     total_test = 0
+    manifests = {train_path: [], test_path: []}
 
     print(f"\nSplitting images with {train_ratio*100:.0f}% " +
           f"train / {(1-train_ratio)*100:.0f}% test ratio:")
@@ -108,11 +189,20 @@ def split_and_distribute_images(images_by_class, train_path,
         print(f"  {class_name}: {train_count} train, " +
               f"{test_count} test (of {total_images} total)")
 
+        if mode == "manifest":
+            manifests[train_path] += [(class_name, image_path)
+                                      for image_path in train_images]
+            manifests[test_path] += [(class_name, image_path)
+                                     for image_path in test_images]
+            total_train += len(train_images)
+            total_test += len(test_images)
+            continue
+
         train_copied = 0
         for image_path in train_images:
             dst_path = train_path / class_name / image_path.name
             try:
-                shutil.copy2(image_path, dst_path)
+                place_image(image_path, dst_path, mode)
                 train_copied += 1
             except Exception as e:
                 print(f"Error copying {image_path} to train: {e}")
@@ -121,7 +211,7 @@ def split_and_distribute_images(images_by_class, train_path,
         for image_path in test_images:
             dst_path = test_path / class_name / image_path.name
             try:
-                shutil.copy2(image_path, dst_path)
+                place_image(image_path, dst_path, mode)
                 test_copied += 1
             except Exception as e:
                 print(f"    Error copying {image_path} to test: {e}")
@@ -129,26 +219,185 @@ def split_and_distribute_images(images_by_class, train_path,
         total_train += train_copied
         total_test += test_copied
 
+    if mode == "manifest":
+        for path, rows in manifests.items():
+            write_manifest(path, rows)
+
     print("\nDistribution complete:")
     print(f"  - Training: {total_train} images")
     print(f"  - Test: {total_test} images")
     print(f"  - Total: {total_train + total_test} images")
 
 
-def split_dataset(path: str, train_ratio: float):
+def hash_fraction(relative_path: str):
+    """Map a path to a stable pseudo-random number in [0, 1)."""
+    digest = hashlib.sha1(relative_path.encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def iter_images(src_path, use_index=False):
+    """Yield (class name, image path) pairs without listing them all."""
+    if not src_path.is_dir():
+        raise NotADirectoryError(f"Source path is not a directory: {src_path}")
+    if use_index:
+        yield from indexed_images(src_path)
+        return
+    for class_dir in sorted(os.scandir(src_path), key=lambda e: e.name):
+        if not class_dir.is_dir():
+            continue
+        with os.scandir(class_dir.path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMG_EXT):
+                    yield class_dir.name, Path(entry.path)
+
+
+def prune_split(split_path, kept, keep_augmented=False):
+    """
+    Remove the images of split_path missing from kept, a set of (class
+    name, filename) pairs, and the class folders left empty. Augmented
+    images recorded by enrichDataset are only kept with keep_augmented,
+    when it runs next and balances the split again, and while their
+    source is kept in this split. Returns the number of images removed.
+    """
+    from Augmentation import AUGMENTED_RECORD, augmentedSource
+    augmented = {}
+    record_path = split_path / AUGMENTED_RECORD
+    if record_path.is_file():
+        with open(record_path) as f:
+            augmented = json.load(f)
+    removed = 0
+    for output in list(augmented):
+        class_name, filename = os.path.split(output)
+        if keep_augmented and \
+                (class_name, augmentedSource(filename)) in kept:
+            continue
+        del augmented[output]
+        if os.path.lexists(split_path / output):
+            os.remove(split_path / output)
+            removed += 1
+    if record_path.is_file():
+        with open(record_path, "w") as f:
+            json.dump(augmented, f, indent=0)
+    for class_dir in os.scandir(split_path):
+        if not class_dir.is_dir():
+            continue
+        with os.scandir(class_dir.path) as entries:
+            stale = [entry.path for entry in entries
+                     if entry.name.lower().endswith(IMG_EXT)
+                     and (class_dir.name, entry.name) not in kept
+                     and os.path.join(class_dir.name, entry.name)
+                     not in augmented]
+        for path in stale:
+            os.remove(path)
+            removed += 1
+        with os.scandir(class_dir.path) as entries:
+            if next(entries, None) is None:
+                os.rmdir(class_dir.path)
+    return removed
+
+
+def hash_split_images(source_path, train_path, test_path,
+                      train_ratio=0.9, mode="copy", use_index=False,
+                      keep_augmented=False):
+    """
+    Assign every image to train or test from a hash of its class/filename
+    path, streaming over the source tree. Assignments never change when
+    images are added, so only images missing from the split are placed,
+    and images no longer in the source are removed from it.
+
+    Args:
+        source_path (Path): Path to the source directory
+        train_path (Path): Path to training directory or manifest
+        test_path (Path): Path to test directory or manifest
+        train_ratio (float): Ratio of images for training (default: 0.9)
+        mode (str): How images reach the split, one of SPLIT_MODES
+        use_index (bool): List images through the dataset index
+        keep_augmented (bool): Keep the augmented images of the train
+            split whose source stays in it, for enrichDataset to run next
+    """
+    counts = defaultdict(lambda: [0, 0])
+    created = set()
+    kept = (set(), set())
+    added = removed = 0
+    manifests = []
+    if mode == "manifest":
+        manifests = [open(train_path, "w", newline=""),
+                     open(test_path, "w", newline="")]
+        writers = [csv.writer(f) for f in manifests]
+        for writer in writers:
+            writer.writerow(["path", "label"])
+
+    print(f"\nHash-splitting images with {train_ratio*100:.0f}% " +
+          f"train / {(1-train_ratio)*100:.0f}% test ratio:")
+    try:
+        for class_name, image_path in iter_images(source_path, use_index):
+            is_test = hash_fraction(f"{class_name}/{image_path.name}") \
+                >= train_ratio
+            counts[class_name][is_test] += 1
+            if mode == "manifest":
+                writers[is_test].writerow([image_path.resolve(), class_name])
+                continue
+            kept[is_test].add((class_name, image_path.name))
+            dst_dir = (test_path if is_test else train_path) / class_name
+            if dst_dir not in created:
+                dst_dir.mkdir(exist_ok=True)
+                created.add(dst_dir)
+            dst_path = dst_dir / image_path.name
+            if dst_path.exists() or dst_path.is_symlink():
+                continue
+            try:
+                place_image(image_path, dst_path, mode)
+                added += 1
+            except Exception as e:
+                print(f"Error copying {image_path}: {e}")
+    finally:
+        for f in manifests:
+            f.close()
+
+    if not counts:
+        raise ValueError("No classes with images found in source directory")
+    if mode != "manifest":
+        removed = prune_split(train_path, kept[0], keep_augmented) + \
+            prune_split(test_path, kept[1])
+    for class_name, (train_count, test_count) in sorted(counts.items()):
+        print(f"  {class_name}: {train_count} train, " +
+              f"{test_count} test (of {train_count + test_count} total)")
+    total_train = sum(train for train, _ in counts.values())
+    total_test = sum(test for _, test in counts.values())
+    print("\nDistribution complete:")
+    print(f"  - Training: {total_train} images")
+    print(f"  - Test: {total_test} images")
+    if mode != "manifest":
+        print(f"  - Newly placed: {added} images")
+        print(f"  - Removed: {removed} images no longer in the source")
+
+
+def split_dataset(path: str, train_ratio: float, mode: str = "copy",
+                  strategy: str = "shuffle", use_index: bool = False,
+                  keep_augmented: bool = False):
     source_path = Path(path).resolve()
     print(f"Processing source directory: {source_path}")
 
-    images_by_class = collect_images_by_class(source_path)
-    train_path, test_path = create_output_directories(source_path,
-                                                      images_by_class)
-    split_and_distribute_images(images_by_class, train_path,
-                                test_path, train_ratio)
+    if strategy == "hash":
+        train_path, test_path = create_output_directories(
+            source_path, {}, mode, reset=False)
+        hash_split_images(source_path, train_path, test_path,
+                          train_ratio, mode, use_index, keep_augmented)
+    else:
+        images_by_class = collect_images_by_class(source_path, use_index)
+        train_path, test_path = create_output_directories(
+            source_path, images_by_class, mode)
+        split_and_distribute_images(images_by_class, train_path,
+                                    test_path, train_ratio, mode)
 
     print("\nSuccess! Created train/test split:")
     print(f"  - Training: {train_path}")
     print(f"  - Test: {test_path}")
-    print("Each directory contains class subfolders with the split images.")
+    if mode == "manifest":
+        print("Each file lists the path and class of its split images.")
+    else:
+        print("Each directory contains class subfolders "
+              "with the split images.")
     return train_path, test_path
 
 
@@ -158,12 +407,24 @@ def main():
         description='Split dataset into train/test sets with class folders')
     parser.add_argument('source_directory',
                         help='Path to the source directory containing\
-                              class folders with .jpg images')
+                              class folders with images')
     parser.add_argument('--train-ratio', type=float, default=0.9,
                         help='Ratio of images for training (default: \
                             0.9 for 90%%)')
     parser.add_argument('--seed', type=int,
                         help='Random seed for reproducible results')
+    parser.add_argument('--mode', choices=SPLIT_MODES, default='copy',
+                        help='copy images, hard/symbolic link them \
+                            (falling back to copies), or only write \
+                            train/test manifest files (default: copy)')
+    parser.add_argument('--strategy', choices=SPLIT_STRATEGIES,
+                        default='shuffle',
+                        help='shuffle: random split rebuilt from scratch, \
+                            hash: stable per-file split from a hash of its \
+                            path, only placing new images (default: shuffle)')
+    parser.add_argument('--index', action='store_true',
+                        help='List images through the dataset index \
+                            instead of scanning the source directory')
 
     args = parser.parse_args()
 
@@ -176,7 +437,8 @@ def main():
         print(f"Using random seed: {args.seed}")
 
     try:
-        split_dataset(args.source_directory, args.train_ratio)
+        split_dataset(args.source_directory, args.train_ratio, args.mode,
+                      args.strategy, args.index)
         return 0
 
     except Exception as e:
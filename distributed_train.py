@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from statistics import median
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+TRAIN = os.path.join(REPO, "train.py")
+
+
+def free_ports(n: int):
+    sockets = [socket.socket() for _ in range(n)]
+    for s in sockets:
+        s.bind(("localhost", 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def cluster_config(ports: list, index: int):
+    """TF_CONFIG of the worker index of a localhost cluster."""
+    return json.dumps({
+        "cluster": {"worker": [f"localhost:{port}" for port in ports]},
+        "task": {"type": "worker", "index": index},
+    })
+
+
+def launch_workers(workers: int, log_dir: str):
+    """
+    Run train.py --worker-index in every worker of a localhost cluster
+    and wait for them. The first worker prints to the console, the
+    others to worker_<index>.log in log_dir. When a worker fails the
+    others are stopped, as they would wait for it forever. Returns
+    whether every worker succeeded.
+    """
+    ports = free_ports(workers)
+    processes, logs = [], []
+    for index in range(workers):
+        log = None
+        if index:
+            log = open(os.path.join(log_dir, f"worker_{index}.log"), "w")
+            logs.append(log)
+        processes.append(subprocess.Popen(
+            [sys.executable, TRAIN, "--worker-index", str(index)],
+            env=dict(os.environ, TF_CONFIG=cluster_config(ports, index)),
+            stdout=log, stderr=subprocess.STDOUT if log else None))
+    try:
+        while any(p.poll() is None for p in processes) and \
+                not any(p.returncode for p in processes):
+            time.sleep(0.5)
+    finally:
+        for p in processes:
+            if p.poll() is None:
+                p.terminate()
+            p.wait()
+        for log in logs:
+            log.close()
+    for index, p in enumerate(processes):
+        if p.returncode:
+            where = f", see {logs[index - 1].name}" if index else ""
+            print(f"Error: worker {index} exited with code "
+                  f"{p.returncode}{where}")
+    return not any(p.returncode for p in processes)
+
+
+def fit_distributed(model, strategy, train_data, validation_data,
+                    epochs: int, callbacks: list, verbose: int = 1,
+                    initial_epoch: int = 0):
+    """
+    model.fit() for a MultiWorkerMirroredStrategy cluster, which the
+    fit() of Keras 3 cannot run. Every step runs the train step of the
+    model on each replica, the optimizer averaging the gradients across
+    workers. Epoch logs are read from the metrics aggregated over all
+    workers, so the callbacks decide the same on every worker. Like for
+    fit(), epochs before initial_epoch are skipped.
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+
+    @tf.function(reduce_retracing=True)
+    def train_step(batch):
+        return strategy.run(model.train_step, args=(batch,))
+
+    @tf.function(reduce_retracing=True)
+    def test_step(batch):
+        return strategy.run(model.test_step, args=(batch,))
+
+    def results(logs):
+        return {name: float(strategy.experimental_local_results(value)[0])
+                for name, value in logs.items()}
+
+    with strategy.scope():
+        callbacks = keras.callbacks.CallbackList(
+            callbacks, add_history=True, add_progbar=verbose != 0,
+            verbose=verbose, epochs=epochs, steps=None, model=model)
+        model.stop_training = False
+        callbacks.on_train_begin()
+        logs = {}
+        for epoch in range(initial_epoch, epochs):
+            model.reset_metrics()
+            callbacks.on_epoch_begin(epoch)
+            batches = iter(train_data)
+            for step in itertools.count():
+                callbacks.on_train_batch_begin(step)
+                batch = batches.get_next_as_optional()
+                if not batch.has_value():
+                    break
+                # Progress shows this worker's running metrics
+                callbacks.on_train_batch_end(
+                    step, results(train_step(batch.get_value())))
+            logs = results(model.get_metrics_result())
+            model.reset_metrics()
+            for batch in validation_data:
+                test_step(batch)
+            logs.update({"val_" + name: value for name, value in
+                         results(model.get_metrics_result()).items()})
+            callbacks.on_epoch_end(epoch, logs)
+            if model.stop_training:
+                break
+        callbacks.on_train_end(logs)
+
+
+def cluster_throughput(metrics_path: str, workers: int):
+    """
+    Training images/s of the whole cluster, median of the epochs after
+    the first one, which also traces the training step. The first
+    worker logs the epochs of its own shard, and the shards are equal.
+    """
+    with open(metrics_path) as f:
+        epochs = [r for r in map(json.loads, f) if r["event"] == "epoch"]
+    if not epochs:
+        return None
+    return round(median(r["images_per_s"] for r in epochs[1:] or epochs)
+                 * workers, 1)
+
+
+def scaling_report(path: str, worker_counts: list, epochs: int = 3,
+                   train_args: list = ()):
+    """
+    Train on path once per worker count with online augmentation and a
+    stable manifest split, and compare the cluster throughput with the
+    single process run: speedup = throughput / single process
+    throughput, efficiency = speedup / workers. The trained models are
+    deleted, only the measurements are kept.
+    """
+    from train import MODEL_DIR, get_training_manifest
+    results = []
+    for workers in sorted({1, *worker_counts}):
+        print(f"Training with {workers} worker(s)...", flush=True)
+        start = time.time()
+        subprocess.run(
+            [sys.executable, TRAIN, path, "--augment", "online",
+             "--split-mode", "manifest", "--split-strategy", "hash",
+             "--epochs", str(epochs), "--workers", str(workers),
+             *train_args], check=True)
+        metrics_path = max(
+            (os.path.join(MODEL_DIR, f) for f in os.listdir(MODEL_DIR)
+             if f.endswith(".metrics.jsonl")), key=os.path.getmtime)
+        if os.path.getmtime(metrics_path) < start:
+            raise RuntimeError(f"training with {workers} worker(s) did "
+                               "not write its metrics")
+        results.append({
+            "workers": workers,
+            "images_per_s": cluster_throughput(metrics_path, workers),
+            "seconds": round(time.time() - start, 3),
+        })
+        model_path = metrics_path[:-len(".metrics.jsonl")] + ".keras"
+        for file in (model_path, get_training_manifest(model_path),
+                     metrics_path):
+            if os.path.exists(file):
+                os.remove(file)
+
+    single = results[0]["images_per_s"]
+    print(f"\n{'Workers':>8}{'Images/s':>12}{'Speedup':>10}"
+          f"{'Efficiency':>12}{'Run s':>10}")
+    for r in results:
+        r["speedup"] = round(r["images_per_s"] / single, 3)
+        r["efficiency"] = round(r["speedup"] / r["workers"], 3)
+        print(f"{r['workers']:>8}{r['images_per_s']:>12.1f}"
+              f"{r['speedup']:>10.2f}{r['efficiency']:>12.1%}"
+              f"{r['seconds']:>10.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the scaling efficiency of data parallel \
+            training over local worker processes against a single process"
+    )
+    parser.add_argument("path_data", help="The path to data to train with")
+    parser.add_argument("--workers", nargs="+", type=int, default=[2],
+                        help="Worker counts to compare with the single \
+                            process run (default: 2)")
+    parser.add_argument("--epochs", type=int, default=3,
+                        help="Epochs per run, the first one is not \
+                            measured (default: 3)")
+    parser.add_argument("--output", default="scaling.json",
+                        help="Results file (default: scaling.json)")
+    args, train_args = parser.parse_known_args()
+
+    if not os.path.isdir(args.path_data):
+        parser.error(f"{args.path_data} is not a directory")
+    if args.epochs < 2 or min(args.workers) < 1:
+        parser.error("--epochs must be at least 2 and --workers at least 1")
+    results = scaling_report(args.path_data, args.workers, args.epochs,
+                             train_args)
+    with open(args.output, "w") as f:
+        json.dump({
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "arguments": vars(args),
+            "train_arguments": train_args,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
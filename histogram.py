@@ -1,38 +1,57 @@
-import cv2
+import argparse
 from PIL import Image
 import numpy as np
-import matplotlib.pyplot as plt
+from os.path import basename, isdir, join
 
-from transformations import gray_scale
+from Distribution import listFolder
+from transformations import LeafAnalysis, get_analysis
 
+# name: (color space, channel index, plot color)
+channels = {
+    "Blue": ("rgb", 2, "blue"),
+    "Blue-Yellow": ("lab", 2, "yellow"),
+    "Green": ("rgb", 1, "green"),
+    "Green-Magenta": ("lab", 1, "magenta"),
+    "Hue": ("hsv", 0, "purple"),
+    "Lightness": ("lab", 0, "grey"),
+    "Red": ("rgb", 0, "red"),
+    "Saturation": ("hsv", 1, "cyan"),
+    "Value": ("hsv", 2, "orange"),
+}
 
-def histogram(img: Image.Image):
-    np_img = np.asarray(img)
-    image = cv2.cvtColor(np_img, cv2.COLOR_BGR2RGB)  # Convert from BGR to RGB
 
+def histogram_mask(analysis: LeafAnalysis):
+    import cv2
     kernel = np.ones((15, 15), np.uint8)
-    mask = cv2.morphologyEx(gray_scale(img), cv2.MORPH_CLOSE, kernel)
-    masked_image = cv2.bitwise_and(image, image, mask=mask)
-
-    lab = cv2.cvtColor(masked_image, cv2.COLOR_RGB2LAB)  # LAB color space
-    hsv = cv2.cvtColor(masked_image, cv2.COLOR_RGB2HSV)  # HSV color space
-
-    channels = {
-        "Blue": (masked_image[:, :, 2], "blue"),
-        "Blue-Yellow": (lab[:, :, 2], "yellow"),
-        "Green": (masked_image[:, :, 1], "green"),
-        "Green-Magenta": (lab[:, :, 1], "magenta"),
-        "Hue": (hsv[:, :, 0], "purple"),
-        "Lightness": (lab[:, :, 0], "grey"),
-        "Red": (masked_image[:, :, 0], "red"),
-        "Saturation": (hsv[:, :, 1], "cyan"),
-        "Value": (hsv[:, :, 2], "orange"),
-    }
+    return cv2.morphologyEx(analysis.mask, cv2.MORPH_CLOSE, kernel)
+
+
+def histogram_matrix(img: Image.Image | LeafAnalysis):
+    """
+    Pixel counts of the leaf for every entry of channels, as a 9x256
+    float32 matrix. Color conversions are pointwise, so the full image is
+    converted and calcHist restricts the counts to the mask.
+    """
+    import cv2
+    analysis = get_analysis(img)
+    mask = histogram_mask(analysis)
+    spaces = {"rgb": cv2.cvtColor(analysis.np_img, cv2.COLOR_BGR2RGB)}
+    spaces["lab"] = cv2.cvtColor(spaces["rgb"], cv2.COLOR_RGB2LAB)
+    spaces["hsv"] = cv2.cvtColor(spaces["rgb"], cv2.COLOR_RGB2HSV)
+
+    matrix = np.empty((len(channels), 256), np.float32)
+    for row, (space, index, _) in enumerate(channels.values()):
+        matrix[row] = cv2.calcHist([spaces[space]], [index], mask,
+                                   [256], [0, 256])[:, 0]
+    return matrix
+
+
+def histogram(img: Image.Image | LeafAnalysis):
+    import matplotlib.pyplot as plt
+    matrix = histogram_matrix(img)
 
     figure = plt.figure(figsize=(10, 6))
-    for channel_name, (channel_data, color) in channels.items():
-        non_masked_values = channel_data[mask > 0]
-        hist, _ = np.histogram(non_masked_values, bins=256, range=(0, 256))
+    for hist, (channel_name, (_, _, color)) in zip(matrix, channels.items()):
         total_pixels = hist.sum()
         hist_percentage = (hist / total_pixels) * 100
         plt.plot(hist_percentage, color=color, label=channel_name)
@@ -45,3 +64,66 @@ def histogram(img: Image.Image):
     plt.grid(True, linestyle="--", alpha=0.5)
 
     return figure
+
+
+def histogram_statistics(src: str, dst: str):
+    """
+    Stream every image of every class folder under src once and write
+    per-class colour profiles to the dst .npz file:
+    counts (summed pixel counts), images (number of images), and
+    mean / std of the per-image normalized histograms.
+    """
+    class_names = []
+    counts, images, sums, squares = [], [], [], []
+    for dir in listFolder(src):
+        total = np.zeros((len(channels), 256), np.float64)
+        profile_sum = np.zeros_like(total)
+        profile_squares = np.zeros_like(total)
+        processed = 0
+        for filename in dir["filenames"]:
+            path = join(dir["path"], filename)
+            try:
+                with Image.open(path) as file:
+                    file.load()
+                    matrix = histogram_matrix(file.convert("RGB"))
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            total += matrix
+            pixels = matrix.sum(axis=1, keepdims=True)
+            profile = matrix / np.maximum(pixels, 1)
+            profile_sum += profile
+            profile_squares += profile ** 2
+            processed += 1
+        class_names.append(basename(dir["path"]))
+        counts.append(total)
+        images.append(processed)
+        sums.append(profile_sum)
+        squares.append(profile_squares)
+        print(f"Class '{class_names[-1]}': {processed} images")
+
+    images = np.array(images, np.int64)
+    n = np.maximum(images, 1)[:, None, None]
+    mean = np.array(sums) / n
+    std = np.sqrt(np.maximum(np.array(squares) / n - mean ** 2, 0))
+    np.savez_compressed(
+        dst,
+        class_names=np.array(class_names),
+        channel_names=np.array(list(channels.keys())),
+        counts=np.array(counts).astype(np.int64),
+        images=images,
+        mean=mean.astype(np.float32),
+        std=std.astype(np.float32),
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Computes per-class colour histogram statistics')
+    parser.add_argument("src", type=str, help='add a dataset folder path')
+    parser.add_argument("dst", type=str, help='add an output .npz path')
+    args = parser.parse_args()
+    if isdir(args.src):
+        histogram_statistics(args.src, args.dst)
+    else:
+        print("Passed path is not a folder or doesn't exist")
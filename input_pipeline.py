@@ -0,0 +1,51 @@
+import tensorflow as tf
+
+CACHE_MODES = ("none", "memory", "disk")
+
+
+def pipeline_options(deterministic: bool = True, threads: int = None):
+    options = tf.data.Options()
+    options.deterministic = deterministic
+    options.autotune.enabled = True
+    options.experimental_optimization.map_parallelization = True
+    if threads:
+        options.threading.private_threadpool_size = threads
+    return options
+
+
+def tune_dataset(dataset, batch_size: int = 32, cache: str = "none",
+                 cache_path: str = None, shuffle: bool = False,
+                 augment=None, deterministic: bool = True,
+                 threads: int = None, seed: int = None):
+    """
+    Input pipeline around a batched (image, label) dataset.
+
+    With a cache, images are decoded and resized once, into memory or
+    into files at cache_path, then reshuffled and rebatched every epoch.
+    The batches of dataset must already hold batch_size images.
+    Online augmentation runs after the cache so every epoch still sees
+    new variants, and batches are prefetched with autotuned buffers and
+    parallelism. deterministic=False lets parallel stages deliver
+    batches out of order instead of waiting for the slowest one.
+    """
+    class_names = dataset.class_names
+    if cache != "none":
+        batches = dataset.cardinality()
+        dataset = dataset.unbatch().cache(
+            str(cache_path) if cache == "disk" else "")
+        if shuffle:
+            dataset = dataset.shuffle(1024, seed=seed,
+                                      reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        if batches >= 0:
+            # Rebatching the same images gives as many batches, but
+            # unbatch() hides the count from fit() and its progress bar
+            dataset = dataset.apply(
+                tf.data.experimental.assert_cardinality(batches))
+    if augment is not None:
+        dataset = dataset.map(augment, num_parallel_calls=tf.data.AUTOTUNE,
+                              deterministic=deterministic)
+    dataset = dataset.prefetch(tf.data.AUTOTUNE).with_options(
+        pipeline_options(deterministic, threads))
+    dataset.class_names = class_names
+    return dataset
@@ -1,15 +1,24 @@
 import tkinter as tk
 from tkinterdnd2 import DND_FILES, TkinterDnD
-from predict import predict_image
+from predict import load_cached_model, predict_image
 from Transformation import transformation_task
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
 
 
 class my_app(TkinterDnD.Tk):
     def __init__(self, model_path: str):
         super().__init__()
+        self.model_dir = model_path
         self.model_path = self.search_newest_model(model_path)
+        # Model loading, prediction and transformations run one at a
+        # time on a worker thread, results come back through self.results
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.results = queue.Queue()
+        self.pending = 0
+        self.drop_id = 0
         self.title("Leaffliction")
         self.geometry("1550x950")
 
@@ -26,23 +35,76 @@ class my_app(TkinterDnD.Tk):
         button = tk.Button(self, text="Predict Image", command=self.predict)
         button.pack()
 
+        self.status = tk.Label(self, text="", font=("Arial", 14))
+        self.status.pack()
+        self.run_in_background(self.warm_up, (self.model_path,),
+                               lambda _: None)
+        self.after(50, self.poll_results)
+
         self.attributes('-topmost', True)
         self.focus_force()
         self.after(100, lambda: self.attributes('-topmost', False))
         self.mainloop()
+        self.worker.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self, model_path):
+        load_cached_model(model_path)
+        from plantcv import plantcv  # noqa: F401
+
+    def run_in_background(self, func, args, on_done):
+        """
+        Run func(*args) on the worker thread, then on_done(result) on
+        the Tk thread. Results of an older drop than the current one
+        are discarded.
+        """
+        drop_id = self.drop_id
+        self.set_busy(1)
+        future = self.worker.submit(func, *args)
+        future.add_done_callback(
+            lambda f: self.results.put((drop_id, on_done, f)))
+
+    def poll_results(self):
+        self.after(50, self.poll_results)
+        while True:
+            try:
+                drop_id, on_done, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.set_busy(-1)
+            if drop_id != self.drop_id:
+                continue
+            try:
+                result = future.result()
+            except BaseException as e:
+                self.show_error(e)
+            else:
+                on_done(result)
 
-    def put_result(self):
+    def set_busy(self, change: int):
+        self.pending += change
+        self.status.configure(text="Working..." if self.pending else "")
+        self.configure(cursor="watch" if self.pending else "")
+
+    def show_error(self, error: BaseException):
+        if isinstance(error, SystemExit):
+            error = "see the console output"
+        self.canvas.create_text(400, 380, text=f"Error: {error}",
+                                font=("Arial", 16), fill="red")
+
+    def put_result(self, predicted_labels):
+        self.predicted_labels = predicted_labels
         self.canvas.create_text(400, 320, text=self.predicted_labels,
                                 font=("Arial", 40, "bold"), fill="green")
 
     def predict(self):
         if hasattr(self, "image_path"):
-            self.predicted_labels = predict_image(
-                self.model_path, self.image_path)
-            self.put_result()
+            self.model_path = self.search_newest_model(self.model_dir)
+            self.run_in_background(predict_image,
+                                   (self.model_path, self.image_path),
+                                   self.put_result)
 
     def search_newest_model(self, path):
-        files = os.listdir(path)
+        files = [f for f in os.listdir(path) if f.endswith(".keras")]
         newest = max([path+f for f in files], key=os.path.getmtime)
         return newest
 
@@ -54,9 +116,14 @@ class my_app(TkinterDnD.Tk):
             self.image_path = self.image_path[1:-1]
         filename = os.path.basename(self.image_path)
         self.put_image_from_directory(self.image_path, filename)
-        self.transformed_img, transform = transformation_task(self.image_path)
+        self.drop_id += 1
+        self.run_in_background(transformation_task, (self.image_path,),
+                               self.put_transformed_image)
+
+    def put_transformed_image(self, result):
+        transformed_img, transform = result
         self.transformed_img = ImageTk.PhotoImage(
-            Image.fromarray(self.transformed_img))
+            Image.fromarray(transformed_img))
         self.put_image_from_data(f"Tranformed Img: {transform}")
 
     def put_image_from_directory(self, path_img, title_img):
@@ -0,0 +1,72 @@
+import numpy as np
+import tensorflow as tf
+
+from dataset_split import read_manifest
+
+
+def load_image(path, label, image_size):
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3,
+                               expand_animations=False)
+    image = tf.image.resize(image, image_size, method="bilinear")
+    image.set_shape((*image_size, 3))
+    return image, label
+
+
+def make_dataset(paths: list, labels: list, class_names: list,
+                 image_size, batch_size, shuffle=False, seed=None):
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=1024, seed=seed)
+    dataset = dataset.map(lambda path, label: load_image(path, label,
+                                                         image_size),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.batch(batch_size)
+    dataset.class_names = class_names
+    dataset.file_paths = paths
+    return dataset
+
+
+def shard(paths: list, labels: list, num_shards: int, shard_index: int):
+    size = len(paths) // num_shards
+    return (paths[shard_index::num_shards][:size],
+            labels[shard_index::num_shards][:size])
+
+
+def dataset_from_manifest(manifest_path, image_size=(64, 64), batch_size=32,
+                          class_names=None, shuffle=False, seed=None,
+                          validation_split=None, num_shards=1,
+                          shard_index=0):
+    """
+    Build the same batched (image, int label) datasets as
+    image_dataset_from_directory from a dataset_split manifest file.
+    With validation_split, returns a (training, validation) pair.
+
+    With num_shards, only every num_shards-th file from shard_index on
+    is kept, after the split, and every shard gets the same number of
+    files so that data parallel workers run the same number of steps.
+    """
+    rows = read_manifest(manifest_path)
+    if class_names is None:
+        class_names = sorted({label for _, label in rows})
+    index = {name: i for i, name in enumerate(class_names)}
+    paths = [path for path, _ in rows]
+    labels = [index[label] for _, label in rows]
+    print(f"Found {len(paths)} files belonging to "
+          f"{len(class_names)} classes.")
+
+    if shuffle or validation_split:
+        order = np.random.RandomState(seed).permutation(len(paths))
+        paths = [paths[i] for i in order]
+        labels = [labels[i] for i in order]
+    if not validation_split:
+        paths, labels = shard(paths, labels, num_shards, shard_index)
+        return make_dataset(paths, labels, class_names,
+                            image_size, batch_size, shuffle, seed)
+
+    split = len(paths) - int(validation_split * len(paths))
+    return (make_dataset(*shard(paths[:split], labels[:split], num_shards,
+                                shard_index),
+                         class_names, image_size, batch_size, shuffle, seed),
+            make_dataset(*shard(paths[split:], labels[split:], num_shards,
+                                shard_index),
+                         class_names, image_size, batch_size))
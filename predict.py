@@ -1,11 +1,12 @@
 import argparse
+import csv
 import numpy as np
-from sklearn.metrics import accuracy_score
 
 import os
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-import tensorflow as tf  # noqa: E402
-from tensorflow.keras.preprocessing.image import load_img  # noqa: E402
+
+IMAGE_SIZE = (64, 64)
+_model_cache = {}
 
 
 def load_class_names(path_model):
@@ -17,6 +18,68 @@ def load_class_names(path_model):
     return class_names
 
 
+class TFLiteModel:
+    """Runs a .tflite model with the same batch in, probabilities out API."""
+
+    def __init__(self, path_model: str, num_threads: int = None):
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_path=path_model,
+                                               num_threads=num_threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.output_shape = tuple(self.output["shape"])
+        self.batch_size = None
+
+    def __call__(self, images: np.ndarray):
+        images = np.asarray(images, np.float32)
+        if len(images) != self.batch_size:
+            self.interpreter.resize_tensor_input(
+                self.input["index"], [len(images), *images.shape[1:]])
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(images)
+        scale, zero_point = self.input["quantization"]
+        if scale:
+            images = np.round(images / scale + zero_point)
+        self.interpreter.set_tensor(self.input["index"],
+                                    images.astype(self.input["dtype"]))
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output["index"])
+        scale, zero_point = self.output["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def load_model(path_model, num_threads=None):
+    if path_model.endswith(".tflite"):
+        return TFLiteModel(path_model, num_threads)
+    import tensorflow as tf
+    return tf.keras.models.load_model(path_model)
+
+
+def predict_batch(model, images):
+    if isinstance(model, TFLiteModel):
+        return model(images)
+    return model(images, training=False).numpy()
+
+
+def load_cached_model(path_model, num_threads=None):
+    """
+    Return (model, class_names) for path_model, loading and warming up
+    the model only on first use or after the file has been replaced.
+    """
+    key = (os.path.abspath(path_model), num_threads)
+    mtime = os.path.getmtime(key[0]) if os.path.exists(key[0]) else None
+    cached = _model_cache.get(key)
+    if cached is None or cached[0] != mtime:
+        model = load_model(path_model, num_threads)
+        class_names = load_class_names(path_model)
+        predict_batch(model, np.zeros((1, *IMAGE_SIZE, 3), np.float32))
+        cached = (mtime, model, class_names)
+        _model_cache[key] = cached
+    return cached[1], cached[2]
+
+
 def find_labels(path):
     for _, direct, _ in os.walk((path)):
         labels = direct
@@ -26,55 +89,139 @@ def find_labels(path):
     return labels
 
 
-def predict(path_model, path_data):
+def print_class_metrics(confusion: np.ndarray, class_names: list):
+    true_counts = confusion.sum(axis=1)
+    predicted_counts = confusion.sum(axis=0)
+    print(f"\n{'Class':<24}{'Precision':>10}{'Recall':>10}"
+          f"{'F1':>10}{'Support':>10}")
+    for i, name in enumerate(class_names):
+        hits = confusion[i, i]
+        precision = hits / predicted_counts[i] if predicted_counts[i] else 0
+        recall = hits / true_counts[i] if true_counts[i] else 0
+        f1 = 2 * precision * recall / (precision + recall) \
+            if precision + recall else 0
+        print(f"{name:<24}{precision:>10.4f}{recall:>10.4f}"
+              f"{f1:>10.4f}{true_counts[i]:>10}")
+
+
+def evaluate(model, dataset, class_names: list, file_paths: list,
+             csv_path: str = None):
+    """
+    Single pass over dataset: every batch is predicted once and folded
+    into a confusion matrix, and optionally written to csv_path.
+    """
+    import tensorflow as tf
+    n_classes = max(len(class_names), model.output_shape[-1])
+    confusion = np.zeros((n_classes, n_classes), np.int64)
+    names = class_names + [str(i) for i in range(len(class_names),
+                                                 n_classes)]
+    csv_file = open(csv_path, "w", newline="") if csv_path else None
+    writer = csv.writer(csv_file) if csv_file else None
+    if writer:
+        writer.writerow(["path", "label", "predicted", "confidence"])
+    seen = 0
     try:
-        model = tf.keras.models.load_model(path_model)
+        for images, labels in dataset.prefetch(tf.data.AUTOTUNE):
+            probabilities = predict_batch(model, images.numpy())
+            predicted = np.argmax(probabilities, axis=1)
+            labels = labels.numpy()
+            np.add.at(confusion, (labels, predicted), 1)
+            if writer:
+                for path, label, index, probs in zip(
+                        file_paths[seen:seen + len(labels)], labels,
+                        predicted, probabilities):
+                    writer.writerow([path, names[label], names[index],
+                                     f"{probs[index]:.4f}"])
+            seen += len(labels)
+    finally:
+        if csv_file:
+            csv_file.close()
+    return confusion
+
+
+def load_evaluation_data(path_model, path_data):
+    """
+    Batched (image, label) dataset of a class folder tree, manifest or
+    pack, labelled in the class order of the model, with the class names
+    of the model and the file path of every image. The classes of
+    path_data are matched by name, as a split can lack some of them.
+    """
+    import tensorflow as tf
+    from dataset_pack import is_pack, packed_dataset
+    from manifest_dataset import dataset_from_manifest
+    class_names = load_class_names(path_model)
+    if is_pack(path_data):
+        dataset = packed_dataset(path_data)
+    elif path_data.endswith(".csv"):
+        dataset = dataset_from_manifest(path_data, image_size=IMAGE_SIZE)
+    else:
+        dataset = tf.keras.utils.image_dataset_from_directory(
+            path_data,
+            labels="inferred",
+            label_mode="int",
+            class_names=None,
+            color_mode="rgb",
+            batch_size=32,
+            image_size=IMAGE_SIZE,
+            shuffle=False,
+            interpolation="bilinear",
+            follow_links=False,
+        )
+    unknown = sorted(set(dataset.class_names) - set(class_names))
+    if unknown:
+        raise ValueError(f"{path_data} has classes the model was not "
+                         f"trained on: {', '.join(unknown)}")
+    model_labels = tf.constant(
+        [class_names.index(name) for name in dataset.class_names], tf.int32)
+    file_paths = dataset.file_paths
+    dataset = dataset.map(
+        lambda images, labels: (images, tf.gather(model_labels, labels)))
+    return dataset, class_names, file_paths
+
+
+def predict(path_model, path_data, csv_path=None, num_threads=None):
+    try:
+        model = load_model(path_model, num_threads)
     except ValueError:
         print(f"Error: no model found at {path_model}")
         return
-
-    dataset = tf.keras.utils.image_dataset_from_directory(
-        path_data,
-        labels="inferred",
-        label_mode="int",
-        class_names=None,
-        color_mode="rgb",
-        batch_size=32,
-        image_size=(64, 64),
-        shuffle=False,
-        interpolation="bilinear",
-        follow_links=False,
-    )
+    try:
+        dataset, class_names, file_paths = load_evaluation_data(path_model,
+                                                                path_data)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        return
 
     print("Making predictions on the entire dataset...")
-    predictions = model.predict(dataset, verbose=0)
-    predicted_labels = np.argmax(predictions, axis=1)
-
-    true_labels = []
-    for _, labels in dataset:
-        true_labels.extend(labels.numpy())
-    true_labels = np.array(true_labels)
+    confusion = evaluate(model, dataset, class_names, file_paths, csv_path)
+    total = confusion.sum()
+    accuracy = np.trace(confusion) / total if total else 0.0
 
-    accuracy = accuracy_score(true_labels, predicted_labels)
-
-    print(f"\nTotal images processed: {len(true_labels)}")
+    print(f"\nTotal images processed: {total}")
     print(f"Accuracy: {accuracy:.4f} ({accuracy*100:.2f}%)")
+    print_class_metrics(confusion, class_names)
+    if csv_path:
+        print(f"\nPer-image predictions written to {csv_path}")
     return accuracy
 
 
-def predict_image(path_model, path_img):
+def load_image_array(path_img):
+    """Decode and resize an image file or file-like object for the model."""
+    from tensorflow.keras.preprocessing.image import load_img
+    img = load_img(path_img, target_size=IMAGE_SIZE)
+    return np.array(img, dtype=np.float32)
+
+
+def predict_image(path_model, path_img, num_threads=None):
     try:
-        model = tf.keras.models.load_model(path_model)
-        class_names = load_class_names(path_model)
+        model, class_names = load_cached_model(path_model, num_threads)
     except ValueError:
         print(f"Error: no model found at {path_model}")
         exit(1)
 
-    img = load_img(path_img, target_size=(64, 64))
-    img = np.array(img)
-    img = np.expand_dims(img, axis=0)
+    img = np.expand_dims(load_image_array(path_img), axis=0)
 
-    predictions = model.predict(img, verbose=0)
+    predictions = predict_batch(model, img)
     predicted_index = np.argmax(predictions)
     predicted_label = class_names[predicted_index]
     print("Predicted label:", predicted_label)
@@ -89,17 +236,35 @@ if __name__ == "__main__":
     parser.add_argument(
         "path_model",
         default="model/",
-        help="Path to the model",
+        help="Path to the .keras or .tflite model",
     )
     parser.add_argument(
         "path_data",
         default="images/",
-        help="Path to the dataset or single image",
+        help="Path to the dataset, a split manifest (.csv), a packed \
+            dataset or single image",
+    )
+
+    parser.add_argument(
+        "--csv",
+        default=None,
+        help="Write per-image predictions of a dataset to this CSV file",
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Interpreter threads for .tflite models",
     )
 
     args = parser.parse_args()
 
-    if os.path.isdir(args.path_data):
-        predict(args.path_model, args.path_data)
+    if not os.path.isfile(args.path_model):
+        print(f"Error: no model found at {args.path_model}")
+    elif os.path.isdir(args.path_data) or args.path_data.endswith(".csv"):
+        predict(args.path_model, args.path_data, args.csv, args.threads)
+    elif os.path.isfile(args.path_data):
+        predict_image(args.path_model, args.path_data, args.threads)
     else:
-        predict_image(args.path_model, args.path_data)
+        print(f"Error: {args.path_data} does not exist")
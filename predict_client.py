@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+from Distribution import listFolder
+
+
+def collect_images(path: str):
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(dir["path"], filename)
+            for dir in listFolder(path) for filename in dir["filenames"]]
+
+
+def post_image(url: str, path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    request = Request(url + "/predict", data=data, method="POST",
+                      headers={"Content-Type": "application/octet-stream"})
+    start = time.perf_counter()
+    with urlopen(request) as response:
+        result = json.load(response)
+    return path, result, time.perf_counter() - start
+
+
+def benchmark(url: str, paths: list, requests: int, concurrency: int):
+    jobs = [paths[i % len(paths)] for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda p: post_image(url, p), jobs))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency * 1000 for _, _, latency in results)
+
+    print(f"{len(results)} requests with concurrency {concurrency} "
+          f"in {elapsed:.2f}s ({len(results) / elapsed:.1f} requests/sec)")
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        index = min(len(latencies) - 1, int(q * len(latencies)))
+        print(f"  latency {name}: {latencies[index]:.1f} ms")
+    with urlopen(url + "/stats") as response:
+        print("Server stats:", json.load(response))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Client and load generator for predict_server.py"
+    )
+    parser.add_argument("path_data", help="Image or folder of images to send")
+    parser.add_argument("--url", default="http://127.0.0.1:8500",
+                        help="Server address (default: http://127.0.0.1:8500)")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="Run a benchmark with this many requests \
+                            instead of predicting each image once")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Parallel requests in benchmark mode \
+                            (default: 8)")
+    args = parser.parse_args()
+
+    paths = collect_images(args.path_data)
+    if not paths:
+        print("Error: no images found")
+    elif args.requests > 0:
+        benchmark(args.url, paths, args.requests, args.concurrency)
+    else:
+        for path in paths:
+            _, result, _ = post_image(args.url, path)
+            print(f"{path}: {result['label']} ({result['confidence']:.4f})")
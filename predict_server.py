@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+
+from predict import load_cached_model, load_image_array, predict_batch
+
+
+class MicroBatcher:
+    """
+    Collects concurrent prediction requests and runs them through the
+    model in batches of at most max_batch images, waiting at most
+    max_wait seconds after the first request of a batch.
+    """
+
+    def __init__(self, path_model: str, max_batch: int, max_wait: float,
+                 num_threads: int = None):
+        self.model, self.class_names = load_cached_model(path_model,
+                                                         num_threads)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.latencies = deque(maxlen=10000)
+        self.counters = {"requests": 0, "errors": 0, "batches": 0}
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, image: np.ndarray) -> Future:
+        future = Future()
+        self.requests.put((image, future, time.perf_counter()))
+        return future
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            images = np.stack([image for image, _, _ in batch])
+            try:
+                probabilities = predict_batch(self.model, images)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self.lock:
+                    self.counters["errors"] += len(batch)
+                continue
+            done = time.perf_counter()
+            with self.lock:
+                self.counters["batches"] += 1
+                self.counters["requests"] += len(batch)
+                for _, _, submitted in batch:
+                    self.latencies.append(done - submitted)
+            for (_, future, _), probs in zip(batch, probabilities):
+                index = int(np.argmax(probs))
+                future.set_result({
+                    "label": self.class_names[index],
+                    "confidence": float(probs[index]),
+                    "batch_size": len(batch),
+                })
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            latencies = np.array(self.latencies) * 1000
+        uptime = time.perf_counter() - self.started
+        counters["uptime_s"] = round(uptime, 3)
+        counters["throughput_per_s"] = round(counters["requests"] / uptime, 3)
+        counters["mean_batch_size"] = round(
+            counters["requests"] / max(counters["batches"], 1), 3)
+        for name, q in (("p50", 50), ("p95", 95), ("p99", 99)):
+            counters[f"latency_{name}_ms"] = round(
+                float(np.percentile(latencies, q)), 3) if len(latencies) \
+                else None
+        return counters
+
+
+class PredictServer(ThreadingHTTPServer):
+    request_queue_size = 256
+
+
+def make_handler(batcher: MicroBatcher):
+    class PredictHandler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_json(200, batcher.stats())
+            else:
+                self.send_json(404, {"error": "unknown path"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_json(404, {"error": "unknown path"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                image = load_image_array(BytesIO(self.rfile.read(length)))
+            except Exception as e:
+                self.send_json(400, {"error": f"invalid image: {e}"})
+                return
+            try:
+                self.send_json(200, batcher.submit(image).result())
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def serve(path_model: str, host: str, port: int, max_batch: int,
+          max_wait_ms: float, num_threads: int = None):
+    batcher = MicroBatcher(path_model, max_batch, max_wait_ms / 1000,
+                           num_threads)
+    server = PredictServer((host, port), make_handler(batcher))
+    print(f"Serving {path_model} on http://{host}:{port} "
+          f"(POST /predict, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(batcher.stats()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local inference server batching concurrent requests"
+    )
+    parser.add_argument("path_model",
+                        help="Path to the .keras or .tflite model")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8500,
+                        help="Port to listen on (default: 8500)")
+    parser.add_argument("--max-batch", type=int, default=32,
+                        help="Largest micro-batch (default: 32)")
+    parser.add_argument("--max-wait-ms", type=float, default=5,
+                        help="Longest wait to fill a micro-batch \
+                            (default: 5)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Interpreter threads for .tflite models")
+    args = parser.parse_args()
+
+    if os.path.isfile(args.path_model):
+        serve(args.path_model, args.host, args.port,
+              args.max_batch, args.max_wait_ms, args.threads)
+    else:
+        print(f"Error: no model found at {args.path_model}")
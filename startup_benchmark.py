@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from statistics import median
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("tensorflow", "plantcv", "cv2", "matplotlib.pyplot",
+                 "tkinter")
+MISSING = "does/not/exist"
+
+# name: (script, arguments of an argument error run)
+CLIS = {
+    "Distribution": ("Distribution.py", [MISSING]),
+    "Augmentation": ("Augmentation.py", [MISSING, MISSING]),
+    "Transformation": ("Transformation.py", ["-src", MISSING]),
+    "histogram": ("histogram.py", [MISSING, MISSING]),
+    "dataset_split": ("dataset_split.py", [MISSING]),
+    "dataset_index": ("dataset_index.py", [MISSING]),
+    "dataset_pack": ("dataset_pack.py", [MISSING, MISSING]),
+    "train": ("train.py", [MISSING]),
+    "distributed_train": ("distributed_train.py", [MISSING]),
+    "predict": ("predict.py", [MISSING, MISSING]),
+    "predict_server": ("predict_server.py", [MISSING]),
+    "predict_client": ("predict_client.py", [MISSING]),
+    "tflite_export": ("tflite_export.py", [MISSING]),
+}
+
+# Runs a script as __main__ and reports which heavy modules it loaded
+RUNNER = """
+import json, runpy, sys
+repo, script, argv = sys.argv[1], sys.argv[2], sys.argv[3:]
+sys.path.insert(0, repo)
+sys.argv = [script] + argv
+try:
+    if script.endswith(".py"):
+        script = repo + "/" + script
+        runpy.run_path(script, run_name="__main__")
+    else:
+        __import__(script)
+except SystemExit:
+    pass
+finally:
+    sys.stderr.write("\\nHEAVY " + json.dumps(
+        [m for m in {heavy} if m in sys.modules]) + "\\n")
+""".format(heavy=HEAVY_MODULES)
+
+
+def time_run(target: str, args: list, runs: int):
+    times = []
+    for _ in range(runs):
+        # A fresh working directory per run, so that nothing a run
+        # creates can turn the missing paths of the next one into real ones
+        with tempfile.TemporaryDirectory() as cwd:
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, "-c", RUNNER, REPO, target] + args,
+                cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                text=True)
+            times.append(time.perf_counter() - start)
+    lines = result.stderr.strip().splitlines()
+    loaded = json.loads(lines[-1][len("HEAVY "):]) \
+        if lines and lines[-1].startswith("HEAVY ") else None
+    return {"seconds": round(median(times), 3),
+            "min_seconds": round(min(times), 3),
+            "heavy_modules": loaded,
+            "error": None if loaded is not None else result.stderr[-300:]}
+
+
+def startup_benchmark(runs: int = 3, budget: float = 1.0):
+    """
+    Time --help and an argument error run of every CLI, and the import
+    of the GUI module, in fresh interpreters. Each case reports its
+    median wall time and which heavy libraries it ended up loading.
+    """
+    cases = []
+    for name, (script, bad_args) in CLIS.items():
+        cases.append((name, "help", script, ["--help"]))
+        cases.append((name, "argument error", script, bad_args))
+    cases.append(("interface", "import", "interface", []))
+
+    results = []
+    print(f"{'CLI':<20}{'Case':<16}{'Median s':>10}{'Min s':>8}  "
+          f"Heavy modules")
+    for name, case, target, args in cases:
+        result = {"cli": name, "case": case, **time_run(target, args, runs)}
+        # A run that crashed says nothing about the startup time
+        result["within_budget"] = not result["error"] and \
+            result["seconds"] <= budget
+        results.append(result)
+        if result["error"]:
+            error = (result["error"].strip().splitlines() or ["no output"])
+            print(f"{name:<20}{case:<16}{'FAILED':>18}  {error[-1]}")
+            continue
+        heavy = ", ".join(result["heavy_modules"])
+        flag = "" if result["within_budget"] else "  SLOW"
+        print(f"{name:<20}{case:<16}{result['seconds']:>10.3f}"
+              f"{result['min_seconds']:>8.3f}  {heavy}{flag}")
+    passed = sum(r["within_budget"] for r in results)
+    failed = sum(bool(r["error"]) for r in results)
+    print(f"{passed}/{len(results)} cases within {budget}s, "
+          f"{failed} failed")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of every CLI entry point"
+    )
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Runs per case, the median is kept (default: 3)")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="Startup budget in seconds (default: 1.0)")
+    parser.add_argument("--json", default=None,
+                        help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = startup_benchmark(args.runs, args.budget)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version.split()[0],
+                       "budget_seconds": args.budget,
+                       "results": results}, f, indent=2)
@@ -0,0 +1,146 @@
+import math
+from functools import lru_cache
+import numpy as np
+import tensorflow as tf
+
+from augmentations import scalingFactor
+
+fillvalue = 255.0
+# The PIL augmentations use pixel constants tuned for the 256x256 leaves
+referenceSize = 256
+
+
+def transform(x, y, scale):
+    y = y + 30 * scale * np.sin(x / (80 * scale))
+    x = x + 30 * scale * np.sin(y / (80 * scale))
+    return x, y
+
+
+@lru_cache(maxsize=16)
+def getSampleGrids(height: int, width: int):
+    """
+    Source pixel coordinates of every output pixel for the geometric
+    augmentations, built once per image size.
+    """
+    scale = width / referenceSize
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    grids = {}
+
+    angle = math.radians(20)
+    cos, sin = math.cos(angle), math.sin(angle)
+    expand = (width * cos + height * sin) / width, \
+        (width * sin + height * cos) / height
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    dx, dy = (x - cx) * expand[0], (y - cy) * expand[1]
+    grids["Rotate"] = (dx * cos + dy * sin + cx, -dx * sin + dy * cos + cy)
+
+    u, v = x / width, y / height
+    corners = np.array([
+        (0, -50 * scale),
+        (-50 * scale, height),
+        (width + 20 * scale, height + 90 * scale),
+        (width, 0),
+    ], dtype=np.float32)
+    weights = [(1 - u) * (1 - v), (1 - u) * v, u * v, u * (1 - v)]
+    grids["Deform"] = (sum(w * c[0] for w, c in zip(weights, corners)),
+                       sum(w * c[1] for w, c in zip(weights, corners)))
+
+    grids["Wave"] = transform(x, y, scale)
+    # Cached as arrays, a tensor would belong to the graph that first
+    # traced the augmentation
+    return {name: (xs.astype(np.float32), ys.astype(np.float32))
+            for name, (xs, ys) in grids.items()}
+
+
+def remap(images, xs, ys):
+    """Bilinear resampling of a batch at fixed source coordinates."""
+    xs, ys = tf.constant(xs), tf.constant(ys)
+    shape = tf.shape(images)
+    batch, height, width = shape[0], shape[1], shape[2]
+    flat = tf.reshape(images, [batch, height * width, 3])
+
+    x0, y0 = tf.floor(xs), tf.floor(ys)
+    fx, fy = (xs - x0)[..., None], (ys - y0)[..., None]
+    x0, y0 = tf.cast(x0, tf.int32), tf.cast(y0, tf.int32)
+
+    def pixel(px, py):
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        index = tf.clip_by_value(py, 0, height - 1) * width + \
+            tf.clip_by_value(px, 0, width - 1)
+        values = tf.gather(flat, index, axis=1)
+        return tf.where(inside[None, ..., None], values, fillvalue)
+
+    top = pixel(x0, y0) * (1 - fx) + pixel(x0 + 1, y0) * fx
+    bottom = pixel(x0, y0 + 1) * (1 - fx) + pixel(x0 + 1, y0 + 1) * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def flip(images):
+    return tf.image.flip_left_right(images)
+
+
+def rotate(images):
+    return remap(images, *getSampleGrids(*images.shape[1:3])["Rotate"])
+
+
+def blur(images):
+    size = images.shape[1:3]
+    small = [max(1, round(side * 0.3)) for side in size]
+    images = tf.image.resize(images, small, method="bicubic")
+    images = tf.image.resize(images, size, method="bicubic")
+    return tf.clip_by_value(images, 0, 255)
+
+
+def contrast(images, cutoff=0.05):
+    shape = tf.shape(images)
+    pixels = tf.sort(tf.reshape(images, [shape[0], -1, 3]), axis=1)
+    count = shape[1] * shape[2]
+    cut = tf.cast(tf.cast(count, tf.float32) * cutoff, tf.int32)
+    low = pixels[:, cut][:, None, None, :]
+    high = pixels[:, count - 1 - cut][:, None, None, :]
+    scale = 255.0 / tf.maximum(high - low, 1.0)
+    stretched = tf.clip_by_value((images - low) * scale, 0, 255)
+    return tf.where(high > low, stretched, images)
+
+
+def crop(images):
+    height, width = images.shape[1:3]
+    border = round(scalingFactor * width)
+    cropped = images[:, border:height - border, border:width - border]
+    return tf.image.resize(cropped, (height, width))
+
+
+def deform(images):
+    return remap(images, *getSampleGrids(*images.shape[1:3])["Deform"])
+
+
+def wave(images):
+    return remap(images, *getSampleGrids(*images.shape[1:3])["Wave"])
+
+
+tf_auguments = {
+    "Flip": flip,
+    "Rotate": rotate,
+    "Blur": blur,
+    "Contrast": contrast,
+    "Crop": crop,
+    "Deform": deform,
+    "Wave": wave
+    }
+
+
+def augment_batch(images, labels):
+    """
+    Replace every image of a batch with one randomly picked augmentation,
+    or keep it unchanged, so that each epoch sees fresh variants. Each
+    augmentation only runs on the images that picked it.
+    """
+    choices = len(tf_auguments) + 1
+    choice = tf.random.uniform(tf.shape(images)[:1], 0, choices,
+                               dtype=tf.int32)
+    indices = tf.dynamic_partition(tf.range(tf.shape(images)[0]), choice,
+                                   choices)
+    parts = tf.dynamic_partition(images, choice, choices)
+    parts = [parts[0]] + [augument(part) for augument, part
+                          in zip(tf_auguments.values(), parts[1:])]
+    return tf.dynamic_stitch(indices, parts), labels
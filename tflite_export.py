@@ -0,0 +1,138 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import psutil
+
+from predict import IMAGE_SIZE, evaluate, load_evaluation_data, \
+    load_model, predict_batch
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+
+def representative_dataset(path: str, num_samples: int):
+    import tensorflow as tf
+    dataset = tf.keras.utils.image_dataset_from_directory(
+        path,
+        labels=None,
+        color_mode="rgb",
+        batch_size=1,
+        image_size=IMAGE_SIZE,
+        shuffle=True,
+        seed=42,
+        interpolation="bilinear",
+    )
+
+    def generator():
+        for images in dataset.take(num_samples):
+            yield [tf.cast(images, tf.float32)]
+    return generator
+
+
+def get_tflite_path(path_model: str, quantization: str):
+    return f"{os.path.splitext(path_model)[0]}_{quantization}.tflite"
+
+
+def export_tflite(path_model: str, quantizations: list,
+                  calibration_path: str = None, num_samples: int = 200):
+    """
+    Convert a .keras model to one .tflite file per quantization, next to
+    the model. int8 post-training quantization is calibrated on
+    num_samples images of calibration_path.
+    """
+    import tensorflow as tf
+    model = tf.keras.models.load_model(path_model)
+    paths = []
+    with tempfile.TemporaryDirectory() as saved_model:
+        model.export(saved_model, verbose=False)
+        for quantization in quantizations:
+            converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+            if quantization == "float16":
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.target_spec.supported_types = [tf.float16]
+            elif quantization == "int8":
+                if not calibration_path:
+                    raise ValueError("int8 export needs calibration images")
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset = representative_dataset(
+                    calibration_path, num_samples)
+            path = get_tflite_path(path_model, quantization)
+            with open(path, "wb") as f:
+                f.write(converter.convert())
+            print(f"Exported {quantization} model to {path} "
+                  f"({os.path.getsize(path) / 2**20:.2f} MiB)")
+            paths.append(path)
+    return paths
+
+
+def measure_backend(path_model: str, data: tuple, num_threads: int,
+                    latency_samples: int = 100):
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    dataset, class_names, file_paths = data
+    model = load_model(path_model, num_threads)
+    sample = next(iter(dataset))[0].numpy()[:1]
+    predict_batch(model, sample)
+    rss_delta = process.memory_info().rss - rss_before
+
+    confusion = evaluate(model, dataset, class_names, file_paths)
+    accuracy = np.trace(confusion) / max(confusion.sum(), 1)
+
+    start = time.perf_counter()
+    for _ in range(latency_samples):
+        predict_batch(model, sample)
+    latency = (time.perf_counter() - start) / latency_samples
+    return {
+        "accuracy": accuracy,
+        "latency_ms": latency * 1000,
+        "size_mib": os.path.getsize(path_model) / 2**20,
+        "rss_mib": rss_delta / 2**20,
+    }
+
+
+def compare_backends(path_model: str, tflite_paths: list, test_path: str,
+                     num_threads: int = None):
+    data = load_evaluation_data(path_model, test_path)
+    print(f"\n{'Model':<40}{'Accuracy':>10}{'Delta':>10}"
+          f"{'Latency ms':>12}{'Size MiB':>10}{'RSS MiB':>10}")
+    baseline = None
+    for path in [path_model] + tflite_paths:
+        result = measure_backend(path, data, num_threads)
+        if baseline is None:
+            baseline = result["accuracy"]
+        print(f"{os.path.basename(path):<40}{result['accuracy']:>10.4f}"
+              f"{result['accuracy'] - baseline:>+10.4f}"
+              f"{result['latency_ms']:>12.3f}{result['size_mib']:>10.2f}"
+              f"{result['rss_mib']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a trained model to quantized TFLite models"
+    )
+    parser.add_argument("path_model", help="Path to the .keras model")
+    parser.add_argument("--quantization", nargs="+", choices=QUANTIZATIONS,
+                        default=["float16", "int8"],
+                        help="Models to export (default: float16 int8)")
+    parser.add_argument("--calibration",
+                        default="submission/augmented_directory",
+                        help="Images used to calibrate int8 quantization")
+    parser.add_argument("--samples", type=int, default=200,
+                        help="Number of calibration images (default: 200)")
+    parser.add_argument("--compare", default=None,
+                        help="Test split to compare accuracy, latency and \
+                            memory of the exported models against Keras")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Interpreter threads for the comparison")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path_model):
+        print(f"Error: no model found at {args.path_model}")
+    else:
+        paths = export_tflite(args.path_model, args.quantization,
+                              args.calibration, args.samples)
+        if args.compare:
+            compare_backends(args.path_model, paths, args.compare,
+                             args.threads)
@@ -1,25 +1,121 @@
 import os
+import json
+import contextlib
+import random
+import shutil
+from collections import Counter
 from datetime import datetime
+from pathlib import Path
 import argparse
-from Augmentation import enrichDataset
-from dataset_split import split_dataset
+from Augmentation import enrichDataset, get_cache_dir
+from Distribution import listFolder
+from dataset_split import SPLIT_MODES, SPLIT_STRATEGIES, iter_images, \
+    read_manifest, split_dataset, write_manifest
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-from tensorflow.keras import layers   # noqa: E402
-from tensorflow import keras   # noqa: E402
+MODEL_DIR = "submission/model"
+CHECKPOINT_DIR = os.path.join(MODEL_DIR, "checkpoint")
 
 
-def main(path: str):
-    train_path = split_dataset(path, 0.95)[0]
-    enrichDataset(train_path)
+def restored_epoch(backup_dir: str):
+    """
+    Epoch a run continues from when BackupAndRestore restores backup_dir,
+    as saved next to the weights at the end of the last epoch.
+    """
+    path = os.path.join(backup_dir, "training_metadata.json")
+    if not os.path.isfile(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)["epoch"]
 
-    train_images, validation_images = keras.utils.image_dataset_from_directory(
+
+def get_class_weights(path, class_names: list):
+    if str(path).endswith(".csv"):
+        counts = Counter(label for _, label in read_manifest(path))
+    else:
+        counts = {os.path.basename(dir["path"]): len(dir["filenames"])
+                  for dir in listFolder(str(path))}
+    maxSize = max(counts.values())
+    return {i: maxSize / counts.get(name, maxSize)
+            for i, name in enumerate(class_names)}
+
+
+def count_images(path):
+    if str(path).endswith(".csv"):
+        return len(read_manifest(path))
+    return sum(len(dir["filenames"]) for dir in listFolder(str(path)))
+
+
+def newest_model(model_dir: str = MODEL_DIR):
+    if not os.path.isdir(model_dir):
+        return None
+    models = [os.path.join(model_dir, f) for f in os.listdir(model_dir)
+              if f.endswith(".keras")]
+    return max(models, key=os.path.getmtime) if models else None
+
+
+def get_training_manifest(model_path: str):
+    return os.path.splitext(model_path)[0] + ".train.csv"
+
+
+def list_split_images(train_path):
+    """(class name, resolved path) of the images of a split."""
+    if str(train_path).endswith(".csv"):
+        return [(label, Path(path).resolve())
+                for path, label in read_manifest(train_path)]
+    return [(class_name, path.resolve())
+            for class_name, path in iter_images(Path(train_path))]
+
+
+def select_fine_tune_images(train_path, base_model: str, replay: float,
+                            seed: int = 42):
+    """
+    Split images that base_model was not trained on, and a random
+    sample of replay older images per new image.
+    """
+    seen = {path for path, _ in read_manifest(
+        get_training_manifest(base_model))}
+    new, old = [], []
+    for class_name, path in list_split_images(train_path):
+        (old if str(path) in seen else new).append((class_name, path))
+    replayed = random.Random(seed).sample(
+        old, min(len(old), round(replay * len(new))))
+    return new, replayed
+
+
+def load_datasets(train_path, class_names: list = None,
+                  batch_size: int = 32, num_shards: int = 1,
+                  shard_index: int = 0):
+    from tensorflow import keras
+    from dataset_pack import is_pack, packed_dataset
+    from manifest_dataset import dataset_from_manifest
+    if is_pack(train_path):
+        return packed_dataset(
+            train_path,
+            batch_size=batch_size,
+            shuffle=True,
+            seed=42,
+            validation_split=0.2,
+        )
+    if str(train_path).endswith(".csv"):
+        return dataset_from_manifest(
+            train_path,
+            image_size=(64, 64),
+            batch_size=batch_size,
+            class_names=class_names,
+            shuffle=True,
+            seed=42,
+            validation_split=0.2,
+            num_shards=num_shards,
+            shard_index=shard_index,
+        )
+    return keras.utils.image_dataset_from_directory(
         train_path,
         labels="inferred",
         label_mode="int",
-        class_names=None,
+        class_names=class_names,
         color_mode="rgb",
-        batch_size=32,
+        batch_size=batch_size,
         image_size=(64, 64),
         seed=42,
         validation_split=0.2,
@@ -28,22 +124,10 @@ def main(path: str):
         follow_links=False,
     )
 
-    if not os.path.exists("submission/model"):
-        os.mkdir("submission/model")
-    with open("submission/model/class_names.txt", "w") as f:
-        for name in train_images.class_names:
-            f.write(name + "\n")
-
-    callback = keras.callbacks.EarlyStopping(
-        monitor="val_loss",
-        patience=1,
-        restore_best_weights=True,
-        min_delta=0,
-        mode="auto",
-        baseline=None,
-        start_from_epoch=5,
-    )
 
+def build_model():
+    from tensorflow.keras import layers
+    from tensorflow import keras
     model = keras.models.Sequential()
     model.add(layers.Input(shape=(64, 64, 3)))
     model.add(layers.Rescaling(1./255))
@@ -63,18 +147,305 @@ def main(path: str):
     optim = keras.optimizers.Adam(learning_rate=0.001)
     metrics = ["accuracy"]
     model.compile(optimizer=optim, loss=loss, metrics=metrics)
+    return model
+
+
+def prepare_run(options: dict, metrics):
+    """
+    Split, select, augment and pack the data of a new run and write its
+    run.json. Returns the run, or None when there is nothing to train.
+    """
+    import tensorflow as tf
+    from dataset_pack import pack_dataset
+    augment = options["augment"]
+    fine_tune = options["fine_tune"]
+    base_model = newest_model() if fine_tune else None
+    if fine_tune and (base_model is None or not os.path.isfile(
+            get_training_manifest(base_model))):
+        print(f"Error: fine-tuning needs a model in {MODEL_DIR} with "
+              "its .train.csv training manifest, train one first")
+        return None
+    metrics.log("run", **options, base_model=base_model,
+                cpu_count=os.cpu_count(), tensorflow=tf.__version__)
+
+    with metrics.stage("split") as stage:
+        # Augmented images only stay in the split when enrichDataset
+        # balances it again below
+        train_path, test_path = split_dataset(
+            options["path"], 0.95, options["split_mode"],
+            options["split_strategy"],
+            keep_augmented=augment == "disk" and not fine_tune)
+        stage["images"] = count_images(train_path) + count_images(test_path)
+
+    if not os.path.exists(MODEL_DIR):
+        os.mkdir(MODEL_DIR)
+    model_path = os.path.join(MODEL_DIR, "model" + datetime.now(
+        ).strftime("_%m-%d_%H:%M:%S") + ".keras")
+    if model_path == base_model or os.path.exists(model_path):
+        # Saving would overwrite that model and its manifest and metrics
+        print(f"Error: {model_path} already exists, start the run again")
+        return None
+    metrics_path = os.path.splitext(model_path)[0] + ".metrics.jsonl"
+    metrics.open(metrics_path)
+    # A new run never restores the checkpoint of another one
+    shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
+    os.makedirs(CHECKPOINT_DIR)
+
+    data_path = train_path
+    if fine_tune:
+        augment = "online"
+        with metrics.stage("select") as stage:
+            new, replayed = select_fine_tune_images(train_path, base_model,
+                                                    options["replay"])
+            stage.update(images=len(new) + len(replayed),
+                         new=len(new), replayed=len(replayed))
+        if not new:
+            print(f"No new images since {base_model} was trained")
+            shutil.rmtree(CHECKPOINT_DIR)
+            metrics.close()
+            os.remove(metrics_path)
+            return None
+        data_path = os.path.join(CHECKPOINT_DIR, "fine_tune.csv")
+        write_manifest(data_path, new + replayed)
+    if augment == "disk":
+        with metrics.stage("augment") as stage:
+            before = count_images(train_path)
+            # The cache lives next to the source images, out of the
+            # split that a new shuffled run deletes
+            enrichDataset(train_path,
+                          cache_dir=get_cache_dir(options["path"]))
+            stage["images"] = count_images(train_path) - before
+    if options["pack"]:
+        with metrics.stage("pack") as stage:
+            data_path = pack_dataset(
+                str(train_path), str(train_path.parent / "packed_train"))
+            stage["images"] = count_images(train_path)
+    if options["workers"] > 1 and not str(data_path).endswith(".csv"):
+        # Workers split the list of training files between them
+        data_path = os.path.join(CHECKPOINT_DIR, "train.csv")
+        write_manifest(data_path, list_split_images(train_path))
+
+    run = {"options": options, "model_path": model_path,
+           "metrics_path": metrics_path, "base_model": base_model,
+           "train_path": str(train_path), "data_path": str(data_path),
+           "augment": augment}
+    with open(os.path.join(CHECKPOINT_DIR, "run.json"), "w") as f:
+        json.dump(run, f, indent=2)
+    return run
+
+
+def train_model(run: dict, metrics, cache: str = "none",
+                deterministic: bool = True, threads: int = None,
+                epochs: int = None, workers: int = 1,
+                worker_index: int = None):
+    """
+    Fit and save the model of a prepared run.
+
+    With a worker_index, this process is one of the workers of the
+    MultiWorkerMirroredStrategy cluster described by TF_CONFIG: every
+    worker decodes its own shard of the files, gradients are averaged
+    across workers at every step and only the first worker saves.
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+    from tf_augmentations import augment_batch
+    from input_pipeline import tune_dataset
+    from predict import load_class_names
+    from train_metrics import EpochTimer
+    strategy = None
+    if worker_index is not None:
+        # The workers share the cores instead of each using all of them
+        tf.config.threading.set_intra_op_parallelism_threads(
+            max(1, (os.cpu_count() or 1) // workers))
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    chief = worker_index in (None, 0)
 
-    epochs = 42
+    base_model = run["base_model"]
+    augment = run["augment"]
+    with metrics.stage("load"):
+        train_images, validation_images = load_datasets(
+            run["data_path"],
+            load_class_names(base_model) if base_model else None)
+    class_names = train_images.class_names
 
-    model.fit(
-        train_images,
-        validation_data=validation_images,
-        epochs=epochs,
-        callbacks=[callback],
+    if chief:
+        with open(os.path.join(MODEL_DIR, "class_names.txt"), "w") as f:
+            for name in class_names:
+                f.write(name + "\n")
+
+    class_weight = None
+    if augment == "online":
+        class_weight = get_class_weights(
+            run["data_path"] if base_model else run["train_path"],
+            class_names)
+    cache_dir = Path(run["train_path"]).parent / "tf_cache"
+    epoch_timer = EpochTimer(metrics)
+
+    def input_pipeline(context=None, validation=False):
+        datasets, batch_size, suffix = \
+            (train_images, validation_images), 32, ""
+        if context is not None:
+            batch_size = context.get_per_replica_batch_size(32)
+            suffix = f"_{context.input_pipeline_id}"
+            datasets = load_datasets(
+                run["data_path"], class_names, batch_size,
+                context.num_input_pipelines, context.input_pipeline_id)
+        if validation:
+            return tune_dataset(
+                datasets[1], batch_size, cache,
+                cache_dir / ("validation" + suffix),
+                deterministic=deterministic, threads=threads)
+        dataset = tune_dataset(
+            datasets[0], batch_size, cache, cache_dir / ("train" + suffix),
+            shuffle=True,
+            augment=augment_batch if augment == "online" else None,
+            deterministic=deterministic, threads=threads, seed=42)
+        if context is not None and class_weight:
+            # Distributed training weighs the samples instead of the loss
+            weights = tf.constant(
+                [class_weight[i] for i in range(len(class_names))])
+            dataset = dataset.map(lambda images, labels: (
+                images, labels, tf.gather(weights, labels)))
+        return epoch_timer.wrap(dataset)
+
+    if strategy is None:
+        train_data = input_pipeline()
+        validation_data = input_pipeline(validation=True)
+    else:
+        train_data = strategy.distribute_datasets_from_function(
+            input_pipeline)
+        validation_data = strategy.distribute_datasets_from_function(
+            lambda context: input_pipeline(context, validation=True))
+
+    callback = keras.callbacks.EarlyStopping(
+        monitor="val_loss",
+        patience=1,
+        restore_best_weights=True,
+        min_delta=0,
+        mode="auto",
+        baseline=None,
+        start_from_epoch=5,
     )
+    # Saves weights, optimizer state and epoch at the end of every epoch
+    # and restores them when the same run is started again
+    backup_dir = CHECKPOINT_DIR if strategy is None else \
+        os.path.join(CHECKPOINT_DIR, f"worker_{worker_index}")
+    checkpoint = keras.callbacks.BackupAndRestore(backup_dir,
+                                                  delete_checkpoint=False)
+
+    with metrics.stage("build"), \
+            strategy.scope() if strategy else contextlib.nullcontext():
+        if base_model:
+            model = keras.models.load_model(base_model)
+            model.compile(
+                optimizer=keras.optimizers.Adam(learning_rate=0.0001),
+                loss=keras.losses.SparseCategoricalCrossentropy(),
+                metrics=["accuracy"])
+        else:
+            model = build_model()
+
+    epochs = epochs or (5 if base_model else 42)
+
+    with metrics.stage("fit"):
+        if strategy is None:
+            model.fit(
+                train_data,
+                validation_data=validation_data,
+                epochs=epochs,
+                callbacks=[callback, epoch_timer, checkpoint],
+                class_weight=class_weight,
+            )
+        else:
+            from distributed_train import fit_distributed
+            fit_distributed(model, strategy, train_data, validation_data,
+                            epochs, [callback, epoch_timer, checkpoint],
+                            verbose=1 if chief else 2,
+                            initial_epoch=restored_epoch(backup_dir))
+    if not chief:
+        return
     print("\033[96mModel train is completed!\033[0m")
-    model.save("submission/model/model" +
-               datetime.now().strftime("_%m-%d_%H:%M") + ".keras")
+    model_path = run["model_path"]
+    with metrics.stage("save"):
+        model.save(model_path)
+        write_manifest(get_training_manifest(model_path),
+                       list_split_images(run["train_path"]))
+
+
+def main(path: str, augment: str = "disk", tflite: list = None,
+         split_mode: str = "copy", split_strategy: str = "shuffle",
+         pack: bool = False, cache: str = "none",
+         deterministic: bool = True, threads: int = None,
+         fine_tune: bool = False, replay: float = 1.0, epochs: int = None,
+         resume: bool = False, workers: int = 1, worker_index: int = None):
+    from train_metrics import RunMetrics
+    options = {"path": path, "augment": augment, "tflite": tflite,
+               "split_mode": split_mode, "split_strategy": split_strategy,
+               "pack": pack, "cache": cache, "deterministic": deterministic,
+               "threads": threads, "fine_tune": fine_tune, "replay": replay,
+               "epochs": epochs, "workers": workers}
+    metrics = RunMetrics()
+
+    if resume or worker_index is not None:
+        with open(os.path.join(CHECKPOINT_DIR, "run.json")) as f:
+            run = json.load(f)
+        if worker_index in (None, 0):
+            metrics.open(run["metrics_path"], append=True)
+        if resume:
+            metrics.log("resume", checkpoint=CHECKPOINT_DIR)
+    else:
+        run = prepare_run(options, metrics)
+        if run is None:
+            return
+    if worker_index is not None:
+        train_model(run, metrics, cache, deterministic, threads, epochs,
+                    workers, worker_index)
+        return
+
+    if cache == "disk":
+        # The split changes between runs, so files cached by a previous
+        # run must never be reused
+        cache_dir = Path(run["train_path"]).parent / "tf_cache"
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cache_dir.mkdir(parents=True)
+    if workers > 1:
+        from distributed_train import launch_workers
+        offset = metrics.file.tell()
+        with metrics.stage("workers"):
+            succeeded = launch_workers(workers, CHECKPOINT_DIR)
+            # The first worker logged its stages and epochs to the file
+            metrics.merge(run["metrics_path"], offset)
+        if not succeeded:
+            print("Training failed, continue it with --resume")
+            metrics.close()
+            return
+    else:
+        train_model(run, metrics, cache, deterministic, threads, epochs)
+
+    model_path = run["model_path"]
+    if tflite:
+        from tflite_export import export_tflite
+        calibration_path = path if split_mode == "manifest" \
+            else run["train_path"]
+        with metrics.stage("tflite_export"):
+            export_tflite(model_path, tflite, str(calibration_path))
+    shutil.rmtree(CHECKPOINT_DIR)
+    metrics.close()
+
+
+def read_run_options():
+    run_path = os.path.join(CHECKPOINT_DIR, "run.json")
+    if not os.path.isfile(run_path):
+        return None
+    with open(run_path) as f:
+        return json.load(f)["options"]
+
+
+def resume_training():
+    options = read_run_options()
+    if options is None:
+        print(f"Error: no interrupted training to resume in {CHECKPOINT_DIR}")
+        return
+    main(**options, resume=True)
 
 
 if __name__ == "__main__":
@@ -84,12 +455,129 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "path_data",
+        nargs="?",
         default="images/",
         help="The path to data to train with",
     )
+    parser.add_argument(
+        "--augment",
+        choices=["disk", "online"],
+        default="disk",
+        help="disk: balance classes by writing augmented images before \
+            training, online: augment batches inside the input pipeline \
+            and balance classes with loss weights",
+    )
+    parser.add_argument(
+        "--tflite",
+        nargs="+",
+        choices=["float32", "float16", "int8"],
+        default=None,
+        help="Also export the trained model to TFLite with these \
+            quantizations, int8 being calibrated on the training split",
+    )
+    parser.add_argument(
+        "--split-mode",
+        choices=SPLIT_MODES,
+        default="copy",
+        help="How the train/test split is materialized, see dataset_split.py \
+            (manifest requires --augment online)",
+    )
+    parser.add_argument(
+        "--split-strategy",
+        choices=SPLIT_STRATEGIES,
+        default="shuffle",
+        help="shuffle: new random split every run, hash: stable split \
+            that only adds new images",
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="Decode and resize the training split once into a \
+            memory-mapped pack and train from it",
+    )
+    parser.add_argument(
+        "--cache",
+        choices=["none", "memory", "disk"],
+        default="none",
+        help="Keep decoded images in memory or in files next to the \
+            split after the first epoch instead of decoding every epoch",
+    )
+    parser.add_argument(
+        "--deterministic",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Keep the batch order reproducible, --no-deterministic lets \
+            parallel input stages deliver batches as soon as they are ready",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Size of the input pipeline thread pool (default: autotuned)",
+    )
+    parser.add_argument(
+        "--epochs",
+        type=int,
+        default=None,
+        help="Number of epochs (default: 42, 5 with --fine-tune)",
+    )
+    parser.add_argument(
+        "--fine-tune",
+        action="store_true",
+        help="Continue training the newest model of submission/model \
+            on the images added to the split since it was trained, with \
+            online augmentation (requires --split-strategy hash)",
+    )
+    parser.add_argument(
+        "--replay",
+        type=float,
+        default=1.0,
+        help="Older images replayed per new image with --fine-tune \
+            (default: 1.0)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Train data parallel in this many local worker processes, \
+            each decoding its own shard of the training files, with \
+            MultiWorkerMirroredStrategy (default: 1)",
+    )
+    parser.add_argument(
+        "--worker-index",
+        type=int,
+        default=None,
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its last epoch checkpoint \
+            with its original options, the other arguments are ignored",
+    )
     args = parser.parse_args()
+    if args.split_mode == "manifest" and args.augment == "disk" \
+            and not args.fine_tune:
+        parser.error("--split-mode manifest requires --augment online")
+    if args.fine_tune and args.split_strategy != "hash":
+        parser.error("--fine-tune requires --split-strategy hash, the "
+                     "shuffle strategy discards the previous split")
+    if args.fine_tune and args.pack:
+        parser.error("--fine-tune cannot be combined with --pack")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and args.pack:
+        parser.error("--workers cannot be combined with --pack")
 
-    if os.path.isdir(args.path_data):
-        main(args.path_data)
+    if args.worker_index is not None:
+        # Started by distributed_train.launch_workers
+        main(**read_run_options(), worker_index=args.worker_index)
+    elif args.resume:
+        resume_training()
+    elif os.path.isdir(args.path_data):
+        main(args.path_data, args.augment, args.tflite, args.split_mode,
+             args.split_strategy, args.pack, args.cache, args.deterministic,
+             args.threads, args.fine_tune, args.replay, args.epochs,
+             workers=args.workers)
     else:
         print("Error: passed path is not a directory")
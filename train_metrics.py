@@ -0,0 +1,224 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from time import perf_counter
+
+import numpy as np
+import psutil
+import tensorflow as tf
+from tensorflow import keras
+
+MIB = 2**20
+
+
+class PeakMemory:
+    """Samples the RSS of the process and of its children in the background."""
+
+    def __init__(self, interval: float = 0.05):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self.peak_children = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        children = 0
+        for child in self.process.children(recursive=True):
+            try:
+                children += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        self.peak_children = max(self.peak_children, children)
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.done.set()
+        self.thread.join()
+        self.sample()
+
+
+def cpu_seconds(process: psutil.Process):
+    times = process.cpu_times()
+    return times.user + times.system + times.children_user + \
+        times.children_system
+
+
+class RunMetrics:
+    """
+    Structured JSON lines log of a training run. Records are kept in
+    memory until open() is given the output path, then every record is
+    written and flushed as soon as it is logged.
+    """
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.process = psutil.Process()
+        self.records = []
+        self.stages = []
+        self.file = None
+
+    def open(self, path: str, append: bool = False):
+        if not append:
+            open(path, "w").close()
+        # Appending never overwrites the records that the first worker
+        # of a distributed run writes to the same file
+        self.file = open(path, "a")
+        for record in self.records:
+            self.write(record)
+
+    def write(self, record: dict):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def log(self, event: str, **fields):
+        record = {"event": event, "time": round(time.time(), 3), **fields}
+        self.records.append(record)
+        if self.file:
+            self.write(record)
+
+    def merge(self, path: str, offset: int):
+        """
+        Add the records another process appended to path after offset
+        to the summary, without writing them again.
+        """
+        with open(path) as f:
+            f.seek(offset)
+            for record in map(json.loads, f):
+                self.records.append(record)
+                if record["event"] == "stage":
+                    self.stages.append(record)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the block and sample its peak memory. The yielded dict can
+        be given an "images" count to also get images/sec.
+        """
+        info = {}
+        start = perf_counter()
+        cpu = cpu_seconds(self.process)
+        failed = True
+        try:
+            with PeakMemory() as memory:
+                yield info
+            failed = False
+        finally:
+            seconds = perf_counter() - start
+            record = {
+                "stage": name,
+                "seconds": round(seconds, 3),
+                "cpu_seconds": round(cpu_seconds(self.process) - cpu, 3),
+                "peak_rss_mib": round(memory.peak / MIB, 1),
+                "peak_children_rss_mib": round(memory.peak_children / MIB,
+                                               1),
+                **info,
+            }
+            if info.get("images"):
+                record["images_per_s"] = round(info["images"] / seconds, 1)
+            if failed:
+                record["failed"] = True
+            self.stages.append(record)
+            self.log("stage", **record)
+
+    def close(self):
+        total = perf_counter() - self.start
+        self.log("summary", seconds=round(total, 3),
+                 stages={s["stage"]: s["seconds"] for s in self.stages})
+        if self.file:
+            self.file.close()
+        print(f"\n{'Stage':<16}{'Seconds':>10}{'Share':>8}"
+              f"{'Peak RSS MiB':>14}{'Images/s':>10}")
+        for s in self.stages:
+            print(f"{s['stage']:<16}{s['seconds']:>10.2f}"
+                  f"{s['seconds'] / total:>8.1%}{s['peak_rss_mib']:>14.1f}"
+                  f"{s.get('images_per_s', ''):>10}")
+        print(f"{'total':<16}{total:>10.2f}")
+        epochs = [r for r in self.records if r["event"] == "epoch"]
+        if epochs:
+            steps = sum(r["steps"] for r in epochs)
+            stall = sum(r["stall_seconds"] for r in epochs)
+            compute = sum(r["compute_seconds"] for r in epochs)
+            print(f"\nTraining steps: {(stall + compute) * 1000 / steps:.1f}"
+                  f" ms/step on average, {stall * 1000 / steps:.1f} ms "
+                  f"waiting for input and {compute * 1000 / steps:.1f} ms "
+                  f"of compute ({stall / (stall + compute):.1%} input bound)")
+
+
+class EpochTimer(keras.callbacks.Callback):
+    """
+    Logs the step times and the input pipeline stall of every epoch.
+
+    wrap() stamps the moment each batch leaves the training dataset.
+    The stall of a step is the time from the start of the step until
+    its batch was handed over, so it stays near zero while the pipeline
+    keeps up with the model. In the first epoch it also includes the
+    tracing of the training step.
+    """
+
+    def __init__(self, metrics: RunMetrics):
+        super().__init__()
+        self.metrics = metrics
+        self.handoffs = []
+
+    def wrap(self, dataset):
+        def record(batch_size):
+            self.handoffs.append((perf_counter(), int(batch_size)))
+            return np.int64(0)
+
+        def stamp(images, *targets):
+            token = tf.py_function(record, [tf.shape(images)[0]], tf.int64)
+            with tf.control_dependencies([token]):
+                return (tf.identity(images),
+                        *(tf.identity(target) for target in targets))
+        return dataset.map(stamp)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.handoffs = []
+        self.begins = []
+        self.ends = []
+        self.epoch_start = perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.begins.append(perf_counter())
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.ends.append(perf_counter())
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = perf_counter()
+        if not self.ends:
+            return
+        begins = np.array(self.begins[:len(self.ends)])
+        steps = np.array(self.ends) - begins
+        handoffs = self.handoffs[:len(steps)]
+        stalls = np.clip([t for t, _ in handoffs] - begins[:len(handoffs)],
+                         0, steps[:len(handoffs)])
+        train_seconds = self.ends[-1] - self.epoch_start
+        images = sum(size for _, size in handoffs)
+        self.metrics.log(
+            "epoch",
+            epoch=epoch + 1,
+            steps=len(steps),
+            train_seconds=round(train_seconds, 3),
+            validation_seconds=round(now - self.ends[-1], 3),
+            step_mean_ms=round(steps.mean() * 1000, 3),
+            step_p50_ms=round(np.percentile(steps, 50) * 1000, 3),
+            step_p95_ms=round(np.percentile(steps, 95) * 1000, 3),
+            stall_seconds=round(stalls.sum(), 3),
+            stall_fraction=round(stalls.sum() / train_seconds, 4),
+            compute_seconds=round(steps.sum() - stalls.sum(), 3),
+            images=images,
+            images_per_s=round(images / train_seconds, 1),
+            **{name: float(value) for name, value in (logs or {}).items()},
+        )
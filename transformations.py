@@ -1,6 +1,6 @@
 from PIL import Image
+from functools import cached_property, lru_cache
 import numpy as np
-from plantcv import plantcv as pcv
 
 fillcolor = "#fff"
 scalingFactor = 0.15
@@ -17,27 +17,65 @@ def get_roi_rectangle(img_mask: np.ndarray):
 
 
 def gray_scale(img: Image.Image):
+    from plantcv import plantcv as pcv
     np_img = np.asarray(img)
     new_img = pcv.rgb2gray_lab(rgb_img=np_img, channel="a")
     new_img = pcv.threshold.otsu(new_img, "dark")
     return new_img
 
 
-def draw_point_on_image(image, coords, color, radius=4):
-    for coord in coords:
-        x, y = coord[0]
-        for i in range(-radius, radius+1):
-            for j in range(-radius, radius+1):
-                if i**2 + j**2 <= radius**2 and \
-                    0 <= x+i < image.shape[1] and \
-                        0 <= y+j < image.shape[0]:
-                    image[y+j, x+i] = color
+class LeafAnalysis:
+    """
+    Per-image intermediates shared by the transforms, each computed on
+    first use so that the mask and ROI are derived once per image.
+    """
 
+    def __init__(self, img: Image.Image):
+        self.img = img
 
-def pseudolandmarks(img: Image.Image):
-    np_img = np.asarray(img)
-    img_mask = gray_scale(img)
-    top, bottom, center = pcv.homology.x_axis_pseudolandmarks(np_img, img_mask)
+    @cached_property
+    def np_img(self):
+        return np.asarray(self.img)
+
+    @cached_property
+    def mask(self):
+        return gray_scale(self.img)
+
+    @cached_property
+    def roi_rectangle(self):
+        return get_roi_rectangle(self.mask)
+
+
+def get_analysis(img):
+    return img if isinstance(img, LeafAnalysis) else LeafAnalysis(img)
+
+
+@lru_cache(maxsize=8)
+def disk_stencil(radius: int):
+    offsets = np.arange(-radius, radius + 1)
+    i, j = np.meshgrid(offsets, offsets, indexing="ij")
+    inside = i**2 + j**2 <= radius**2
+    return i[inside], j[inside]
+
+
+def draw_point_on_image(image, coords, color, radius=4):
+    points = np.asarray(coords).reshape(-1, 2)
+    if len(points) == 0:
+        return
+    i, j = disk_stencil(radius)
+    xs = (points[:, 0:1] + i).ravel()
+    ys = (points[:, 1:2] + j).ravel()
+    inside = (0 <= xs) & (xs < image.shape[1]) & \
+        (0 <= ys) & (ys < image.shape[0])
+    image[ys[inside], xs[inside]] = color
+
+
+def pseudolandmarks(img: Image.Image | LeafAnalysis):
+    from plantcv import plantcv as pcv
+    analysis = get_analysis(img)
+    np_img = analysis.np_img
+    top, bottom, center = pcv.homology.x_axis_pseudolandmarks(
+        np_img, analysis.mask)
 
     new_img = np_img.copy()
 
@@ -47,23 +85,23 @@ def pseudolandmarks(img: Image.Image):
     return new_img
 
 
-def gaussian_blur(img: Image.Image):
-    np_img = gray_scale(img)
-    return pcv.gaussian_blur(np_img, (3, 3))
+def gaussian_blur(img: Image.Image | LeafAnalysis):
+    from plantcv import plantcv as pcv
+    return pcv.gaussian_blur(get_analysis(img).mask, (3, 3))
 
 
-def mask(img: Image.Image):
-    np_img = np.asarray(img)
-    img_mask = gray_scale(img)
-    return pcv.apply_mask(np_img, img_mask, 'white')
+def mask(img: Image.Image | LeafAnalysis):
+    from plantcv import plantcv as pcv
+    analysis = get_analysis(img)
+    return pcv.apply_mask(analysis.np_img, analysis.mask, 'white')
 
 
-def roi_objects(img: Image.Image):
-    np_img = np.asarray(img)
-    img_mask = gray_scale(img)
-    y_min, y_max, x_min, x_max = get_roi_rectangle(img_mask)
+def roi_objects(img: Image.Image | LeafAnalysis):
+    analysis = get_analysis(img)
+    img_mask = analysis.mask
+    y_min, y_max, x_min, x_max = analysis.roi_rectangle
 
-    new_img = np_img.copy()
+    new_img = analysis.np_img.copy()
     new_img[img_mask > 0] = GREEN
     thickness = 2
     new_img[y_min-thickness:y_min, x_min-thickness:x_max + thickness] = BLUE
@@ -73,12 +111,15 @@ def roi_objects(img: Image.Image):
     return new_img
 
 
-def analyze_objects(img: Image.Image):
+def analyze_objects(img: Image.Image | LeafAnalysis):
+    from plantcv import plantcv as pcv
     pcv.params.line_thickness = 2
-    np_img = np.asarray(img)
-    img_mask = gray_scale(img)
-    y_min, y_max, x_min, x_max = get_roi_rectangle(img_mask)
-    roi = pcv.roi.rectangle(img, x_min, y_min, y_max - y_min, x_max - x_min)
+    analysis = get_analysis(img)
+    np_img = analysis.np_img
+    img_mask = analysis.mask
+    y_min, y_max, x_min, x_max = analysis.roi_rectangle
+    roi = pcv.roi.rectangle(np_img, x_min, y_min,
+                            y_max - y_min, x_max - x_min)
     filtered_mask = pcv.roi.filter(mask=img_mask, roi=roi, roi_type="partial")
     return pcv.analyze.size(img=np_img, labeled_mask=filtered_mask, n_labels=1)
 